@@ -5,22 +5,29 @@ Extended AI functionality with automatic command execution and file interpretati
 """
 
 import os
+import sys
 import json
+import asyncio
+import time
+import shlex
+import codecs
+import glob
+import itertools
 import mimetypes
 import subprocess
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 import re
 from dataclasses import dataclass
 
-# File type handlers
-try:
-    import PyPDF2
-    import docx
-    from PIL import Image
-    import pandas as pd
-except ImportError:
-    pass
+from ai_core import JsonFileCache
+
+mimetypes.add_type('application/jsonl', '.jsonl')
+mimetypes.add_type('application/jsonl', '.ndjson')
+
+# File type handler libraries (PyPDF2, python-docx, Pillow, pandas) are
+# imported by the _handle_* methods on first use to keep startup fast
 
 @dataclass
 class SafetyRule:
@@ -30,11 +37,172 @@ class SafetyRule:
     reason: str
     auto_execute: bool = False
 
+# Leading literal command word of an anchored pattern, e.g. "ls" in r'^ls\s'
+_LEADING_WORD_RE = re.compile(r'^\^([a-z0-9_.+-]+)(?=\\s|\$|$)')
+
+# Shell operators, longest first so runs like ")|" or "2>&1" split correctly
+_SHELL_OPERATORS = ('&>>', '<<<', '&&', '||', '|&', ';;', '>>', '<<', '>&', '<&', '&>', '>|',
+                    ';', '&', '|', '(', ')', '<', '>')
+_REDIRECT_OPERATORS = {'>', '>>', '>|', '&>', '&>>', '>&', '<', '<<', '<<<', '<&'}
+_OUTPUT_REDIRECTS = {'>', '>>', '>|', '&>', '&>>', '>&'}
+_PIPE_OPERATORS = {'|', '|&'}
+# Words that only introduce or close a compound command
+_SHELL_KEYWORDS = {'{', '}', '!', 'if', 'then', 'else', 'elif', 'fi', 'do', 'done', 'while', 'until', 'esac', 'time'}
+_ASSIGNMENT_RE = re.compile(r'^[a-z_][a-z0-9_]*=')
+
+@dataclass(frozen=True)
+class CommandSegment:
+    """A simple command within a parsed command line"""
+    words: Tuple[str, ...]
+    redirects: Tuple[Tuple[str, str], ...] = ()
+    piped_input: bool = False
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.words[0]) if self.words else ''
+
+    @property
+    def text(self) -> str:
+        """Command text as the safety rules expect it (program name without its path)"""
+        return ' '.join((self.name,) + self.words[1:])
+
+def _split_operators(token: str) -> List[str]:
+    operators = []
+    while token:
+        operator = next((op for op in _SHELL_OPERATORS if token.startswith(op)), token[0])
+        operators.append(operator)
+        token = token[len(operator):]
+    return operators
+
+@lru_cache(maxsize=4096)
+def parse_shell_command(command: str) -> Optional[Tuple[CommandSegment, ...]]:
+    """Split a command line into simple commands at ;, &&, ||, |, & and subshell parentheses.
+
+    Returns None for syntax the safety check cannot see through (command
+    substitution, unbalanced quotes); callers must treat that conservatively.
+    """
+    if '`' in command or '$(' in command or '<(' in command or '>(' in command:
+        return None
+    
+    lexer = shlex.shlex(command.replace('\n', ' ; '), posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        return None
+    
+    segments = []
+    words: List[str] = []
+    redirects: List[Tuple[str, str]] = []
+    piped_input = False
+    pending_redirect = None
+    
+    def flush(next_piped: bool):
+        nonlocal words, redirects, piped_input
+        while words and words[0] in _SHELL_KEYWORDS:
+            words.pop(0)
+        while words and _ASSIGNMENT_RE.match(words[0]):
+            words.pop(0)
+        if words or redirects:
+            segments.append(CommandSegment(tuple(words), tuple(redirects), piped_input))
+        words, redirects = [], []
+        piped_input = next_piped
+    
+    for token in tokens:
+        if token and all(ch in '();<>|&' for ch in token):
+            for operator in _split_operators(token):
+                if operator in _REDIRECT_OPERATORS:
+                    # "2>" style: the number is a file descriptor, not an argument
+                    if words and words[-1].isdigit():
+                        words.pop()
+                    pending_redirect = operator
+                else:
+                    flush(next_piped=operator in _PIPE_OPERATORS)
+        elif pending_redirect:
+            redirects.append((pending_redirect, token))
+            pending_redirect = None
+        else:
+            words.append(token)
+    
+    if pending_redirect:
+        return None
+    flush(next_piped=False)
+    return tuple(segments)
+
+class AnalysisCache(JsonFileCache):
+    """On-disk cache of file analysis results.
+
+    Entries are keyed by the file's real path, size and mtime together with
+    the handler that produced them and its version, so an edited file or an
+    updated handler never returns a stale result. Least recently used entries
+    are evicted once the cache exceeds `max_bytes` or `max_entries`.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 1000):
+        super().__init__(directory, max_entries, max_bytes)
+
+    @classmethod
+    def make_key(cls, filepath: str, file_stat: os.stat_result, handler: str, version: int, options: Any = None) -> str:
+        """Hash a file's identity together with the handler that analyzes it"""
+        return cls.hash_key(os.path.realpath(filepath), file_stat.st_size, file_stat.st_mtime_ns,
+                            handler, version, options)
+
 class AIAgent:
+    # Read-only commands that are safe when no safety rule matched
+    SAFE_PATTERNS = [
+        r'^echo\s+',
+        r'^which\s+',
+        r'^type\s+',
+        r'^history\s*$',
+        r'^date\s*$',
+    ]
+    
+    # Read-only filters that may be auto-executed when they only consume another command's
+    # output, with the number of positional arguments that are not files (grep's pattern, tr's sets)
+    PIPE_FILTERS = {'grep': 1, 'egrep': 1, 'fgrep': 1, 'sort': 0, 'wc': 0, 'head': 0, 'tail': 0,
+                    'cut': 0, 'tr': 2, 'column': 0, 'nl': 0, 'cat': 0, 'less': 0, 'more': 0}
+    # Short options of those filters whose value is the next word
+    PIPE_FILTER_VALUE_OPTIONS = {'grep': 'emABC', 'egrep': 'emABC', 'fgrep': 'emABC', 'sort': 'ktST',
+                                 'head': 'nc', 'tail': 'nc', 'cut': 'bcdf', 'column': 'csR',
+                                 'nl': 'bdfhilnsvw'}
+    # Programs that would execute whatever is piped into them
+    PIPE_INTERPRETERS = {'sh', 'bash', 'zsh', 'dash', 'ksh', 'fish', 'python', 'python3', 'perl',
+                         'ruby', 'node', 'php', 'source', 'eval', 'xargs'}
+    
+    # Commands that change the state later commands run in (directory, environment)
+    STATEFUL_COMMANDS = {'cd', 'pushd', 'popd', 'export', 'unset', 'source', '.', 'alias', 'set'}
+    
     def __init__(self, ai_core):
         self.ai_core = ai_core
         self.safety_rules = self._init_safety_rules()
         self.file_handlers = self._init_file_handlers()
+        self.rebuild_safety_matcher()
+        # Maximum number of auto-executed commands running at the same time
+        self.max_parallel_commands = max(1, int(os.getenv('NLSHELL_AGENT_CONCURRENCY', '4')))
+        
+        cache_dir = getattr(ai_core, 'cache_dir', None) or Path.home() / '.nlshell_cache'
+        # Analysis results, reused until the file or its handler changes
+        self.analysis_cache = None
+        if os.getenv('NLSHELL_ANALYSIS_CACHE', 'true').lower() not in ('0', 'false', 'no', 'off'):
+            self.analysis_cache = AnalysisCache(
+                cache_dir / 'analysis',
+                max_bytes=int(float(os.getenv('NLSHELL_ANALYSIS_CACHE_MAX_MB', '64')) * 1024 * 1024),
+                max_entries=int(os.getenv('NLSHELL_ANALYSIS_CACHE_MAX_ENTRIES', '1000'))
+            )
+        
+        # Extracted PDF text, reused until the document changes
+        self.pdf_cache = None
+        if os.getenv('NLSHELL_PDF_CACHE', 'true').lower() not in ('0', 'false', 'no', 'off'):
+            self.pdf_cache = JsonFileCache(
+                cache_dir / 'pdf_text',
+                max_entries=int(os.getenv('NLSHELL_PDF_CACHE_MAX_ENTRIES', '100'))
+            )
+        # Extractions of at least this many pages use a process pool
+        self.pdf_parallel_pages = max(1, int(os.getenv('NLSHELL_PDF_PARALLEL_PAGES', '16')))
+        
+        # Batch analysis: worker processes and the most files one request may cover
+        self.analysis_workers = max(1, int(os.getenv('NLSHELL_ANALYSIS_WORKERS', str(os.cpu_count() or 1))))
+        self.batch_max_files = max(1, int(os.getenv('NLSHELL_BATCH_MAX_FILES', '500')))
     
     def _init_safety_rules(self) -> List[SafetyRule]:
         """Initialize safety rules for automatic command execution"""
@@ -84,16 +252,27 @@ class AIAgent:
             SafetyRule(r'wget.*\|\s*bash', False, "Piped execution not allowed", False),
         ]
     
+    # Bump a handler's version when its output changes so cached analyses are redone
+    HANDLER_VERSIONS = {
+        '_handle_text_file': 3,
+        '_handle_json_file': 3,
+        '_handle_csv_file': 2,
+        '_handle_excel_file': 2,
+        '_handle_pdf_file': 3,
+    }
+    
     def _init_file_handlers(self) -> Dict[str, callable]:
         """Initialize file type handlers"""
         return {
             'text/plain': self._handle_text_file,
             'application/json': self._handle_json_file,
+            'application/jsonl': self._handle_json_file,
             'application/pdf': self._handle_pdf_file,
             'application/msword': self._handle_doc_file,
             'application/vnd.openxmlformats-officedocument.wordprocessingml.document': self._handle_docx_file,
             'text/csv': self._handle_csv_file,
             'application/vnd.ms-excel': self._handle_excel_file,
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': self._handle_excel_file,
             'image/jpeg': self._handle_image_file,
             'image/png': self._handle_image_file,
             'image/gif': self._handle_image_file,
@@ -101,33 +280,131 @@ class AIAgent:
             'audio/mpeg': self._handle_audio_file,
         }
     
-    def check_command_safety(self, command: str) -> Tuple[bool, bool, str]:
-        """Check if command is safe to execute
-        Returns: (is_safe, auto_execute, reason)
+    def rebuild_safety_matcher(self):
+        """Compile safety_rules into matchers indexed by leading command word.
+
+        Call again after changing self.safety_rules at runtime.
         """
-        command_lower = command.lower().strip()
+        # Verdicts in rule order: safety rules first, then the basic safe patterns
+        verdicts = [(rule.pattern, (rule.allowed, rule.auto_execute and rule.allowed, rule.reason))
+                    for rule in self.safety_rules]
+        verdicts += [(pattern, (True, True, "Basic safe command")) for pattern in self.SAFE_PATTERNS]
         
-        # Check against safety rules
-        for rule in self.safety_rules:
-            if re.match(rule.pattern, command_lower):
-                return rule.allowed, rule.auto_execute and rule.allowed, rule.reason
+        # Patterns anchored on a literal word only need checking for commands starting with it;
+        # everything else is checked for every command
+        by_word: Dict[str, List[int]] = {}
+        unindexed: List[int] = []
+        for i, (pattern, _) in enumerate(verdicts):
+            match = _LEADING_WORD_RE.match(pattern)
+            if match:
+                by_word.setdefault(match.group(1), []).append(i)
+            else:
+                unindexed.append(i)
         
-        # Default to safe for basic read-only operations
-        safe_patterns = [
-            r'^echo\s+',
-            r'^which\s+',
-            r'^type\s+',
-            r'^history\s*$',
-            r'^date\s*$',
-        ]
+        def combine(indices: List[int]):
+            # re.match tries alternatives left to right, so the first rule in order wins
+            if not indices:
+                return None
+            return re.compile('|'.join(f'(?P<r{i}>{verdicts[i][0]})' for i in sorted(indices)))
         
-        for pattern in safe_patterns:
-            if re.match(pattern, command_lower):
-                return True, True, "Basic safe command"
+        self._safety_verdicts = [verdict for _, verdict in verdicts]
+        self._safety_matchers = {word: combine(indices + unindexed) for word, indices in by_word.items()}
+        self._default_safety_matcher = combine(unindexed)
+        self._check_safety_cached = lru_cache(maxsize=4096)(self._evaluate_command)
+    
+    def _evaluate_safety(self, command_lower: str) -> Tuple[bool, bool, str]:
+        """Evaluate a normalized (lowercased, stripped) command against the compiled rules"""
+        parts = command_lower.split(None, 1)
+        matcher = self._safety_matchers.get(parts[0] if parts else '', self._default_safety_matcher)
+        
+        match = matcher.match(command_lower) if matcher else None
+        if match:
+            for name, value in match.groupdict().items():
+                if value is not None and name[0] == 'r' and name[1:].isdigit():
+                    return self._safety_verdicts[int(name[1:])]
         
         # Default: not auto-executable but ask user
         return True, False, "Requires user confirmation"
     
+    def _evaluate_segment(self, segment: CommandSegment) -> Tuple[bool, bool, str]:
+        """Evaluate one simple command, including its redirections and pipe input"""
+        for operator, target in segment.redirects:
+            if operator not in _OUTPUT_REDIRECTS or target == '/dev/null' or target.isdigit() or target == '-':
+                continue
+            if re.match(r'/(etc|usr|bin)/', target):
+                return False, False, "System directory writing not allowed"
+            return True, False, "Writing to files requires confirmation"
+        
+        if not segment.words:
+            return True, True, "Basic safe command"
+        
+        if segment.piped_input:
+            if segment.name in self.PIPE_INTERPRETERS:
+                return False, False, "Piped execution not allowed"
+            if self._filters_piped_input_only(segment):
+                verdict = self._evaluate_safety(segment.text)
+                # Rules can still forbid a filter, otherwise it is safe on piped input
+                return verdict if not verdict[0] else (True, True, "Safe pipeline filter")
+        
+        # Anything else, including filters given files, goes through the normal rules
+        return self._evaluate_safety(segment.text)
+    
+    def _filters_piped_input_only(self, segment: CommandSegment) -> bool:
+        """True if segment is a known filter that reads nothing but its piped input and writes nothing"""
+        if segment.name not in self.PIPE_FILTERS:
+            return False
+        value_options = self.PIPE_FILTER_VALUE_OPTIONS.get(segment.name, '')
+        operands = []
+        args = iter(segment.words[1:])
+        for word in args:
+            if word == '--':
+                operands.extend(args)
+                break
+            if word.startswith('--'):
+                # Output files, followed files, recursion and lists of input files
+                if (word.startswith(('--output', '--follow', '--recursive', '--dereference-recursive',
+                                     '--directories', '--file', '--files0-from'))):
+                    return False
+            elif word.startswith('-') and word != '-':
+                if word in ('-o', '-f', '-F'):
+                    return False  # output file, follow / pattern file
+                if segment.name in ('grep', 'egrep', 'fgrep') and ('r' in word or 'R' in word or word == '-d'):
+                    return False  # recursive search reads the directory tree, not the pipe
+                if len(word) == 2 and word[1] in value_options:
+                    next(args, None)
+            else:
+                operands.append(word)
+        allowed = self.PIPE_FILTERS[segment.name]
+        if allowed and segment.name != 'tr' and any(word in ('-e', '--regexp') or word.startswith('--regexp=')
+                                                     for word in segment.words):
+            allowed = 0  # the pattern came from -e, positionals are files
+        return len([word for word in operands if word != '-']) <= allowed
+    
+    def _evaluate_command(self, command_lower: str) -> Tuple[bool, bool, str]:
+        """Evaluate every simple command of a command line and return the strictest verdict"""
+        # Whole-line rules (e.g. "curl ... | bash") can only make the verdict stricter
+        whole_line = self._evaluate_safety(command_lower)
+        if not whole_line[0]:
+            return whole_line
+        
+        segments = parse_shell_command(command_lower)
+        if segments is None:
+            return True, False, "Complex shell syntax requires confirmation"
+        if not segments:
+            return True, False, "Requires user confirmation"
+        
+        # Strictness: blocked < needs confirmation < auto-executable
+        return min((self._evaluate_segment(segment) for segment in segments),
+                   key=lambda verdict: (verdict[0], verdict[1]))
+    
+    def check_command_safety(self, command: str) -> Tuple[bool, bool, str]:
+        """Check if command is safe to execute
+        Compound commands (;, &&, ||, pipes, subshells, redirections) get the
+        strictest verdict of their parts.
+        Returns: (is_safe, auto_execute, reason)
+        """
+        return self._check_safety_cached(command.lower().strip())
+    
     async def auto_execute_safe_command(self, command: str) -> Tuple[int, str, str]:
         """Execute command if it's deemed safe"""
         is_safe, auto_execute, reason = self.check_command_safety(command)
@@ -150,19 +427,58 @@ class AIAgent:
                 except OSError as e:
                     return 1, "", str(e)
             
-            process = await asyncio.create_subprocess_shell(
-                command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=os.getcwd()
-            )
-            
-            stdout, stderr = await process.communicate()
-            return process.returncode, stdout.decode('utf-8'), stderr.decode('utf-8')
+            return await self.ai_core.run_command(command, os.getcwd())
             
         except Exception as e:
             return 1, "", str(e)
     
+    def _command_effects(self, command: str) -> Tuple[bool, set, set]:
+        """What a command does to its surroundings: (changes_state, files_written, paths_used)"""
+        segments = parse_shell_command(command.strip())
+        if segments is None:
+            # Can't see through it, so never reorder around it
+            return True, set(), set()
+        
+        changes_state = any(segment.name in self.STATEFUL_COMMANDS for segment in segments)
+        written = {target for segment in segments for operator, target in segment.redirects
+                   if operator in _OUTPUT_REDIRECTS and target != '/dev/null' and not target.isdigit()}
+        used = {word for segment in segments for word in segment.words[1:]}
+        used |= {target for segment in segments for _, target in segment.redirects}
+        return changes_state, written, used
+    
+    @staticmethod
+    def _must_follow(earlier: Tuple[bool, set, set], later: Tuple[bool, set, set]) -> bool:
+        """Whether the later command has to wait for the earlier one"""
+        earlier_state, earlier_written, earlier_used = earlier
+        later_state, later_written, later_used = later
+        return (earlier_state or later_state
+                or bool(earlier_written & (later_used | later_written))
+                or bool(later_written & earlier_used))
+    
+    async def _run_auto_commands(self, commands: List[str]) -> List[Tuple[int, str, str]]:
+        """Run auto-executable commands, concurrently where they don't depend on each other.
+
+        A command waits for every earlier command it depends on (directory or
+        environment changes, files one writes and the other uses); the rest run
+        in parallel, at most max_parallel_commands at a time. Results keep the
+        order of commands.
+        """
+        semaphore = asyncio.Semaphore(self.max_parallel_commands)
+        effects = [self._command_effects(command) for command in commands]
+        tasks: List[asyncio.Task] = []
+        
+        async def run(command: str, dependencies: List[asyncio.Task]) -> Tuple[int, str, str]:
+            if dependencies:
+                await asyncio.wait(dependencies)
+            async with semaphore:
+                return await self.auto_execute_safe_command(command)
+        
+        for j, command in enumerate(commands):
+            dependencies = [tasks[i] for i in range(j) if self._must_follow(effects[i], effects[j])]
+            tasks.append(asyncio.ensure_future(run(command, dependencies)))
+        
+        return list(await asyncio.gather(*tasks))
+    
     async def process_agent_query(self, query: str, current_dir: str, history: List[Dict]) -> Dict[str, Any]:
         """Process agent query with automatic command execution and interpretation"""
         
@@ -182,11 +498,13 @@ class AIAgent:
         final_data = []
         
         # Execute safe commands automatically
-        for command in ai_response.suggested_commands:
-            is_safe, auto_execute, reason = self.check_command_safety(command)
-            
+        verdicts = [self.check_command_safety(command) for command in ai_response.suggested_commands]
+        auto_commands = [command for command, (_, auto_execute, _) in zip(ai_response.suggested_commands, verdicts) if auto_execute]
+        outcomes = iter(await self._run_auto_commands(auto_commands))
+        
+        for command, (is_safe, auto_execute, reason) in zip(ai_response.suggested_commands, verdicts):
             if auto_execute:
-                returncode, stdout, stderr = await self.auto_execute_safe_command(command)
+                returncode, stdout, stderr = next(outcomes)
                 executed_commands.append(command)
                 
                 if returncode == 0:
@@ -259,13 +577,27 @@ class AIAgent:
         """
         
         try:
-            interpretation = await self.ai_core._call_ai(prompt)
+            interpretation = await self.ai_core._call_ai(prompt, site='agent')
             return interpretation
         except Exception as e:
             return f"Error interpreting results: {str(e)}"
     
-    async def analyze_file(self, filepath: str) -> Dict[str, Any]:
-        """Analyze file content based on its type"""
+    def _analysis_cache_key(self, filepath: str, file_stat: os.stat_result, mime_type: Optional[str],
+                            page_range: Optional[Tuple[int, int]] = None) -> Optional[str]:
+        """Cache key for analyzing filepath, or None when the cache is disabled"""
+        if self.analysis_cache is None:
+            return None
+        handler_name = self.file_handlers.get(mime_type, self._handle_text_file).__name__
+        options = None
+        if handler_name == '_handle_pdf_file':
+            options = page_range
+        elif handler_name == '_handle_csv_file':
+            options = os.getenv('NLSHELL_CSV_STATS')
+        return AnalysisCache.make_key(filepath, file_stat, handler_name,
+                                      self.HANDLER_VERSIONS.get(handler_name, 1), options)
+    
+    async def analyze_file(self, filepath: str, page_range: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+        """Analyze file content based on its type (page_range applies to PDFs)"""
         
         if not os.path.exists(filepath):
             return {
@@ -284,66 +616,454 @@ class AIAgent:
             'type': 'file_analysis'
         }
         
-        # Handle based on file type
-        if mime_type in self.file_handlers:
-            try:
-                content = await self.file_handlers[mime_type](filepath)
-                result['content'] = content
-            except Exception as e:
+        # Handle based on file type, falling back to reading it as text
+        handler = self.file_handlers.get(mime_type, self._handle_text_file)
+        handler_name = handler.__name__
+        
+        cache_key = self._analysis_cache_key(filepath, file_stat, mime_type, page_range)
+        if cache_key is not None:
+            cached = self.analysis_cache.get(cache_key)
+            if cached is not None:
+                result['content'] = cached
+                result['cached'] = True
+                return result
+        
+        try:
+            if handler_name == '_handle_pdf_file':
+                content = await handler(filepath, page_range)
+            else:
+                content = await handler(filepath)
+            result['content'] = content
+        except Exception as e:
+            if mime_type in self.file_handlers:
                 result['error'] = f"Error reading file: {str(e)}"
-        else:
-            # Try to read as text
-            try:
-                content = await self._handle_text_file(filepath)
-                result['content'] = content
-            except:
+            else:
                 result['error'] = "Unsupported file type or binary file"
+            return result
+        
+        # Errors (such as a missing optional library) are not cached
+        if cache_key is not None and not content.get('error'):
+            self.analysis_cache.put(cache_key, content)
         
         return result
     
-    async def _handle_text_file(self, filepath: str) -> Dict[str, Any]:
-        """Handle text files"""
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
+    # Directories never worth descending into when inventorying a tree
+    BATCH_SKIP_DIRS = {'.git', '.hg', '.svn', '__pycache__', 'node_modules', '.venv', 'venv', '.tox', '.mypy_cache'}
+    
+    def expand_analysis_target(self, target: str, cwd: Optional[str] = None) -> List[str]:
+        """Resolve a file, directory (walked recursively) or glob pattern to file paths"""
+        target = os.path.expanduser(target)
+        if not os.path.isabs(target):
+            target = os.path.join(cwd or os.getcwd(), target)
+        
+        if any(ch in target for ch in '*?['):
+            paths = (path for path in sorted(glob.iglob(target, recursive=True)) if os.path.isfile(path))
+        elif os.path.isdir(target):
+            def walk():
+                for root, dirs, files in os.walk(target):
+                    dirs[:] = sorted(d for d in dirs if d not in self.BATCH_SKIP_DIRS and not d.startswith('.'))
+                    for name in sorted(files):
+                        path = os.path.join(root, name)
+                        if os.path.isfile(path):
+                            yield path
+            paths = walk()
+        else:
+            paths = iter([target])
+        return list(itertools.islice(paths, self.batch_max_files))
+    
+    async def analyze_batch(self, paths: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        """Analyze many files, yielding each result as soon as it is ready.
+
+        Cached analyses are answered in-process; the rest are spread over a
+        process pool, since PDF, DOCX and image parsing is CPU bound.
+        """
+        pending = []
+        for filepath in paths:
+            try:
+                file_stat = os.stat(filepath)
+            except OSError:
+                yield {'filepath': filepath, 'type': 'error', 'error': f"File not found: {filepath}"}
+                continue
+            mime_type, _ = mimetypes.guess_type(filepath)
+            cache_key = self._analysis_cache_key(filepath, file_stat, mime_type)
+            cached = self.analysis_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                yield {'filepath': filepath, 'size': file_stat.st_size, 'mime_type': mime_type,
+                       'type': 'file_analysis', 'content': cached, 'cached': True}
+            else:
+                pending.append(filepath)
+        
+        if len(pending) < 2 or self.analysis_workers < 2:
+            for filepath in pending:
+                yield await self.analyze_file(filepath)
+            return
         
+        from concurrent.futures import ProcessPoolExecutor
+        loop = asyncio.get_running_loop()
+        executor = ProcessPoolExecutor(max_workers=min(self.analysis_workers, len(pending)))
+        try:
+            futures = [loop.run_in_executor(executor, _analyze_file_in_worker, filepath) for filepath in pending]
+            for future in asyncio.as_completed(futures):
+                try:
+                    yield await future
+                except Exception as e:
+                    yield {'type': 'error', 'error': f"Analysis worker failed: {str(e)}"}
+        finally:
+            # Drop queued work if the caller stopped listening early
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    def summarize_batch(results: List[Dict[str, Any]], largest: int = 5) -> Dict[str, Any]:
+        """Aggregate batch results: counts by type, total size and the largest files"""
+        by_type: Dict[str, int] = {}
+        sizes = []
+        errors = 0
+        for result in results:
+            content = result.get('content') or {}
+            if result.get('error') or content.get('error'):
+                errors += 1
+                kind = 'error'
+            else:
+                kind = content.get('type') or result.get('mime_type') or 'unknown'
+            by_type[kind] = by_type.get(kind, 0) + 1
+            if 'size' in result:
+                sizes.append((result['size'], result['filepath']))
+        sizes.sort(reverse=True)
         return {
+            'files': len(results),
+            'total_size': sum(size for size, _ in sizes),
+            'by_type': dict(sorted(by_type.items(), key=lambda item: -item[1])),
+            'largest': [{'filepath': path, 'size': size} for size, path in sizes[:largest]],
+            'errors': errors,
+            'cached': sum(1 for result in results if result.get('cached')),
+        }
+    
+    # Byte order marks, longest first (UTF-32 LE starts with the UTF-16 LE mark)
+    TEXT_BOMS = [
+        (codecs.BOM_UTF32_LE, 'utf-32'),
+        (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16'),
+    ]
+    # UTF-8 continuation bytes (10xxxxxx) don't start a character
+    _UTF8_CONTINUATION = bytes(range(0x80, 0xC0))
+    
+    @classmethod
+    def _detect_text_encoding(cls, sample: bytes) -> str:
+        """Guess the encoding of a file from its first bytes"""
+        for bom, encoding in cls.TEXT_BOMS:
+            if sample.startswith(bom):
+                return encoding
+        if sample.isascii():
+            return 'ascii'
+        try:
+            # The sample may end inside a multi-byte character
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            return 'latin-1'
+    
+    def _analyze_text_stream(self, filepath: str, preview_chars: int = 2000, chunk_size: int = 1 << 20) -> Dict[str, Any]:
+        """Scan a text file in fixed-size binary chunks with bounded memory.
+
+        Lines are counted on raw bytes, the preview stops decoding once it is
+        full and characters are counted without decoding (exact for UTF-8,
+        ASCII and single-byte encodings). A file that starts out as ASCII is
+        reported as UTF-8 (or Latin-1) if other bytes show up later.
+        """
+        newlines = 0
+        characters = 0
+        total_bytes = 0
+        ends_with_newline = True
+        preview = ""
+        preview_done = False
+        # Checks the rest of a file that started out as ASCII once other bytes show up
+        validator = None
+        
+        with open(filepath, 'rb') as f:
+            chunk = f.read(chunk_size)
+            encoding = self._detect_text_encoding(chunk[:65536])
+            # ASCII is a subset of UTF-8, which keeps the preview right if other bytes follow
+            decoder = codecs.getincrementaldecoder('utf-8' if encoding == 'ascii' else encoding)(errors='replace')
+            # UTF-16/32 newlines span several bytes, so those are counted on decoded text
+            wide = encoding in ('utf-16', 'utf-32')
+            counting_decoder = codecs.getincrementaldecoder(encoding)(errors='replace') if wide else None
+            looks_binary = b'\0' in chunk[:8192] and not wide
+            
+            while chunk:
+                if wide:
+                    text = counting_decoder.decode(chunk)
+                    newlines += text.count('\n')
+                    characters += len(text)
+                    ends_with_newline = text.endswith('\n') if text else ends_with_newline
+                else:
+                    newlines += chunk.count(b'\n')
+                    total_bytes += len(chunk)
+                    if encoding == 'ascii' and not chunk.isascii():
+                        encoding = 'utf-8'
+                        validator = codecs.getincrementaldecoder('utf-8')()
+                    if validator is not None:
+                        try:
+                            validator.decode(chunk)
+                        except UnicodeDecodeError:
+                            # Not UTF-8 after all: every byte is a character
+                            encoding, validator = 'latin-1', None
+                    if encoding in ('ascii', 'utf-8', 'utf-8-sig'):
+                        # Same as the byte count for pure ASCII
+                        characters += len(chunk.translate(None, self._UTF8_CONTINUATION))
+                    ends_with_newline = chunk.endswith(b'\n')
+                
+                if not preview_done:
+                    preview += decoder.decode(chunk)
+                    preview_done = len(preview) > preview_chars
+                
+                chunk = f.read(chunk_size)
+        
+        if not wide and encoding not in ('ascii', 'utf-8', 'utf-8-sig'):
+            characters = total_bytes
+        if encoding == 'utf-8-sig' and characters:
+            characters -= 1  # the BOM is not content
+        
+        lines = newlines + (0 if ends_with_newline or not characters else 1)
+        
+        result = {
             'type': 'text',
-            'preview': content[:2000] + "..." if len(content) > 2000 else content,
-            'lines': len(content.splitlines()),
-            'characters': len(content)
+            'preview': preview[:preview_chars] + "..." if len(preview) > preview_chars else preview,
+            'lines': lines,
+            'characters': characters,
+            'encoding': encoding
         }
+        if looks_binary:
+            result['binary'] = True
+        return result
+    
+    async def _handle_text_file(self, filepath: str) -> Dict[str, Any]:
+        """Handle text files"""
+        return await asyncio.to_thread(self._analyze_text_stream, filepath)
+    
+    # Skips scalars and bracket-free strings in C, stopping at the next bracket
+    # or at a string that contains one
+    _JSON_TOKEN_RE = re.compile(rb'[^"\[\]{}]*(?:"[^"\\\[\]{}]*(?:\\.[^"\\\[\]{}]*)*"[^"\[\]{}]*)*'
+                                rb'([\[\]{}]|"[^"\\]*(?:\\.[^"\\]*)*")')
+    # Strings (flagged when used as an object key) and commas between top-level tokens
+    _JSON_GAP_RE = re.compile(rb'("[^"\\]*(?:\\.[^"\\]*)*")\s*(:)?|,')
+    _NON_SPACE_RE = re.compile(rb'\S')
+    # Scalars and bracket-free strings between top-level values
+    _JSON_SCALAR_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[^\s"\[\]{},:]+')
+    JSON_TYPE_NAMES = {ord('{'): 'dict', ord('['): 'list', ord('"'): 'str', ord('t'): 'bool',
+                       ord('f'): 'bool', ord('n'): 'NoneType'}
+    JSON_MAX_KEYS = 200
+    
+    @staticmethod
+    def _indent_json_prefix(text: str, indent: int = 2) -> str:
+        """Pretty-print the start of a JSON document, which may be cut off anywhere"""
+        out = []
+        level = 0
+        in_string = escaped = False
+        for ch in text:
+            if in_string:
+                out.append(ch)
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+                out.append(ch)
+            elif ch in '{[':
+                level += 1
+                out.append(ch + '\n' + ' ' * (indent * level))
+            elif ch in '}]':
+                level = max(0, level - 1)
+                out.append('\n' + ' ' * (indent * level) + ch)
+            elif ch == ',':
+                out.append(',\n' + ' ' * (indent * level))
+            elif ch == ':':
+                out.append(': ')
+            elif not ch.isspace():
+                out.append(ch)
+        return ''.join(out)
+    
+    def _scan_json_structure(self, filepath: str, preview_chars: int = 1000) -> Dict[str, Any]:
+        """Describe a JSON or JSON-lines file without parsing it into objects.
+
+        A regex walks the memory-mapped file token by token, tracking nesting
+        depth, top-level keys and top-level element counts; scalar values are
+        never materialized.
+        """
+        import mmap
+        
+        with open(filepath, 'rb') as f:
+            head = f.read(preview_chars * 4)
+            if not head.strip():
+                raise ValueError("Empty JSON document")
+            # mmap releases pages as the scan moves on, so memory stays flat
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        try:
+            start = len(codecs.BOM_UTF8) if head.startswith(codecs.BOM_UTF8) else 0
+            first = self._NON_SPACE_RE.search(data, start)
+            structure = self.JSON_TYPE_NAMES.get(data[first.start()], 'number')
+            
+            depth = max_depth = 0
+            records = 0          # completed top-level values
+            keys: List[str] = []
+            key_count = 0
+            commas = 0           # separators between top-level array elements
+            stack = bytearray()  # open containers
+            opened_at = gap_start = start
+            
+            def scan_gap(end: int):
+                # Keys and commas only matter directly inside the top-level container
+                nonlocal key_count, commas
+                for gap in self._JSON_GAP_RE.finditer(data, gap_start, end):
+                    if gap.group(2):
+                        key_count += 1
+                        if len(keys) < self.JSON_MAX_KEYS:
+                            keys.append(json.loads(gap.group(1)))
+                    elif not gap.group(1):
+                        commas += 1
+            
+            def count_scalars(end: int) -> int:
+                # The token regex skips scalars, so top-level ones are found in the gaps
+                return sum(1 for _ in self._JSON_SCALAR_RE.finditer(data, gap_start, end))
+            
+            for match in self._JSON_TOKEN_RE.finditer(data, start):
+                kind = data[match.start(1)]
+                if depth == 0:
+                    records += count_scalars(match.start(1))
+                elif depth == 1 and records == 0:
+                    scan_gap(match.start(1))
+                if kind == 0x22:  # string containing a bracket
+                    if depth == 0:
+                        records += 1
+                    elif depth == 1 and records == 0 and stack[-1] == 0x7B:
+                        follow = self._NON_SPACE_RE.search(data, match.end(1))
+                        if follow and data[follow.start()] == 0x3A:  # a key
+                            key_count += 1
+                            if len(keys) < self.JSON_MAX_KEYS:
+                                keys.append(json.loads(match.group(1)))
+                elif kind in (0x7B, 0x5B):  # { [
+                    stack.append(kind)
+                    depth += 1
+                    if depth > max_depth:
+                        max_depth = depth
+                    if depth == 1:
+                        opened_at = match.end(1)
+                else:  # } ]
+                    if not stack or stack.pop() != (0x7B if kind == 0x7D else 0x5B):
+                        raise ValueError(f"Mismatched bracket at byte {match.start(1)}")
+                    depth -= 1
+                    if depth == 0:
+                        records += 1
+                        if records == 1 and kind == 0x5D:
+                            empty = not self._NON_SPACE_RE.search(data, opened_at, match.start(1))
+                            elements = 0 if empty else commas + 1
+                gap_start = match.end(1)
+            if stack:
+                raise ValueError("Unexpected end of JSON document")
+            records += count_scalars(len(data))
+            
+            result = {
+                'type': 'json',
+                'structure': structure,
+                'keys': keys if structure == 'dict' else None,
+                'length': key_count if structure == 'dict' else elements if structure == 'list' else None,
+                'depth': max_depth,
+            }
+            if records > 1:
+                # Several top-level values: JSON lines; keys describe the first record
+                result.update({'structure': 'jsonl', 'records': records, 'record_type': structure, 'length': records})
+        finally:
+            data.close()
+        
+        text = head.decode('utf-8-sig', errors='ignore')
+        if '\n' not in text.strip() and records <= 1:
+            text = self._indent_json_prefix(text)
+        truncated = len(text) > preview_chars or len(head) < os.path.getsize(filepath)
+        result['preview'] = text[:preview_chars] + ("..." if truncated else "")
+        return result
     
     async def _handle_json_file(self, filepath: str) -> Dict[str, Any]:
-        """Handle JSON files"""
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        """Handle JSON and JSON-lines files"""
+        return await asyncio.to_thread(self._scan_json_structure, filepath)
+    
+    # Pages extracted by default when no page range is given
+    PDF_DEFAULT_PAGES = 3
+    
+    def _pdf_cache_key(self, filepath: str) -> str:
+        """Cache key for a PDF's extracted text: path, mtime and size"""
+        file_stat = os.stat(filepath)
+        return JsonFileCache.hash_key(os.path.realpath(filepath), file_stat.st_mtime_ns, file_stat.st_size)
+    
+    async def _extract_pdf_text(self, filepath: str, indices: List[int]) -> Dict[int, str]:
+        """Extract the given pages, spreading large extractions over a process pool"""
+        if len(indices) < self.pdf_parallel_pages:
+            return await asyncio.to_thread(_extract_pdf_pages, filepath, indices)
         
-        return {
-            'type': 'json',
-            'structure': str(type(data).__name__),
-            'keys': list(data.keys()) if isinstance(data, dict) else None,
-            'length': len(data) if isinstance(data, (list, dict)) else None,
-            'preview': json.dumps(data, indent=2)[:1000] + "..." if len(str(data)) > 1000 else json.dumps(data, indent=2)
-        }
+        from concurrent.futures import ProcessPoolExecutor
+        workers = min(os.cpu_count() or 1, max(1, len(indices) // 4))
+        if workers == 1:
+            return await asyncio.to_thread(_extract_pdf_pages, filepath, indices)
+        # Contiguous batches so each worker parses only the pages it needs
+        size = -(-len(indices) // workers)
+        batches = [indices[i:i + size] for i in range(0, len(indices), size)]
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(executor, _extract_pdf_pages, filepath, batch) for batch in batches
+            ))
+        text = {}
+        for result in results:
+            text.update(result)
+        return text
     
-    async def _handle_pdf_file(self, filepath: str) -> Dict[str, Any]:
-        """Handle PDF files"""
+    async def _handle_pdf_file(self, filepath: str, page_range: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+        """Handle PDF files.
+
+        page_range is 1-based and inclusive; by default the first few pages
+        are extracted. Extracted page text is cached on disk, so later
+        questions about the same document only parse pages not seen before.
+        """
         try:
             import PyPDF2
-            with open(filepath, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                pages = len(reader.pages)
-                
-                # Extract text from first few pages
-                text = ""
-                for i in range(min(3, pages)):
-                    text += reader.pages[i].extract_text()
-                
-                return {
-                    'type': 'pdf',
-                    'pages': pages,
-                    'text_preview': text[:1500] + "..." if len(text) > 1500 else text
-                }
+            cache_key = self._pdf_cache_key(filepath)
+            cached = (self.pdf_cache.get(cache_key) if self.pdf_cache is not None else None) or {}
+            pages = cached.get('pages')
+            # JSON object keys are strings
+            text = {int(i): page_text for i, page_text in cached.get('text', {}).items()}
+            
+            if pages is None:
+                def count_pages():
+                    with open(filepath, 'rb') as f:
+                        return len(PyPDF2.PdfReader(f).pages)
+                pages = await asyncio.to_thread(count_pages)
+            
+            first, last = page_range or (1, self.PDF_DEFAULT_PAGES)
+            if first > last:
+                first, last = last, first
+            if page_range is not None and first > pages:
+                return {'error': f'Page range {first}-{last} is out of bounds: the document has {pages} page(s)'}
+            first, last = max(1, first), min(pages, last)
+            wanted = list(range(first - 1, last))
+            missing = [i for i in wanted if i not in text]
+            if missing:
+                text.update(await self._extract_pdf_text(filepath, missing))
+            if self.pdf_cache is not None and (missing or not cached):
+                self.pdf_cache.put(cache_key, {'pages': pages, 'text': text})
+            
+            extracted = "\n".join(f"[Page {i + 1}]\n{text[i]}" for i in wanted)
+            limit = 1500 if page_range is None else min(20000, 1500 * max(1, len(wanted)))
+            return {
+                'type': 'pdf',
+                'pages': pages,
+                'page_range': [first, last] if wanted else None,
+                'cached_pages': len(wanted) - len(missing),
+                'text_preview': extracted[:limit] + "..." if len(extracted) > limit else extracted
+            }
         except ImportError:
             return {'error': 'PyPDF2 not installed. Install with: pip install PyPDF2'}
         except Exception as e:
@@ -369,29 +1089,143 @@ class AIAgent:
         except Exception as e:
             return {'error': f'Error reading DOCX: {str(e)}'}
     
+    # Distinct hashes kept per column by the cardinality sketch
+    CSV_SKETCH_SIZE = 1024
+    
+    @staticmethod
+    def _count_lines(filepath: str, chunk_size: int = 1 << 20) -> int:
+        """Count lines with a raw newline scan (quoted newlines count as rows)"""
+        lines = 0
+        last = b'\n'
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                lines += chunk.count(b'\n')
+                last = chunk[-1:]
+        return lines + (last != b'\n')
+    
+    def _profile_csv(self, filepath: str, sample_rows: int = 1000) -> Dict[str, Any]:
+        """Profile a CSV file in chunks sized to stay under NLSHELL_CSV_MEMORY_MB.
+
+        Dtypes come from a sample, the row count from a newline scan and, when
+        NLSHELL_CSV_STATS is on, per-column null counts, min/max and distinct
+        estimates are accumulated chunk by chunk.
+        """
+        import numpy as np
+        import pandas as pd
+        
+        memory_limit = max(1, int(os.getenv('NLSHELL_CSV_MEMORY_MB', '256'))) * 1024 * 1024
+        collect_stats = os.getenv('NLSHELL_CSV_STATS', 'true').lower() not in ('0', 'false', 'no', 'off')
+        
+        sample = pd.read_csv(filepath, nrows=sample_rows)
+        columns = [str(column) for column in sample.columns]
+        result = {
+            'type': 'csv',
+            'rows': max(0, self._count_lines(filepath) - 1),  # Subtract header
+            'columns': len(columns),
+            'column_names': columns,
+            'preview': sample.head().to_string(),
+            'data_types': {column: str(dtype) for column, dtype in zip(columns, sample.dtypes)},
+        }
+        if not collect_stats or len(sample) < sample_rows:
+            # The sample already holds the whole file
+            if collect_stats:
+                result['rows'] = len(sample)
+                result['column_stats'] = self._csv_column_stats(sample, columns, sample.dtypes)
+            return result
+        
+        # Chunk budget: a quarter of the ceiling, leaving room for parsing buffers
+        row_bytes = max(1, sample.memory_usage(deep=True).sum() // max(1, len(sample)))
+        target_bytes = memory_limit // 4
+        chunk_rows = max(1, target_bytes // row_bytes)
+        
+        numeric = [pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+                   for dtype in sample.dtypes]
+        nulls = [0] * len(columns)
+        minimums: List[Any] = [None] * len(columns)
+        maximums: List[Any] = [None] * len(columns)
+        sketches = [np.empty(0, dtype=np.uint64) for _ in columns]
+        rows = 0
+        
+        with pd.read_csv(filepath, chunksize=chunk_rows, low_memory=True) as reader:
+            while True:
+                try:
+                    chunk = reader.get_chunk(chunk_rows)
+                except StopIteration:
+                    break
+                rows += len(chunk)
+                for i in range(len(columns)):
+                    series = chunk.iloc[:, i]
+                    nulls[i] += int(series.isna().sum())
+                    if numeric[i]:
+                        values = pd.to_numeric(series, errors='coerce')
+                        low, high = values.min(), values.max()
+                        if pd.notna(low):
+                            minimums[i] = low if minimums[i] is None else min(minimums[i], low)
+                            maximums[i] = high if maximums[i] is None else max(maximums[i], high)
+                    hashes = pd.util.hash_pandas_object(series.dropna(), index=False).to_numpy()
+                    sketches[i] = np.unique(np.concatenate((sketches[i], hashes)))[:self.CSV_SKETCH_SIZE]
+                
+                # Rows can vary a lot in width; resize the next chunk to the budget
+                used = chunk.memory_usage(deep=True).sum()
+                if used:
+                    chunk_rows = max(1, int(chunk_rows * target_bytes / used))
+                del chunk
+        
+        result['rows'] = rows
+        result['column_stats'] = {
+            column: {
+                'nulls': nulls[i],
+                'min': self._plain_value(minimums[i]),
+                'max': self._plain_value(maximums[i]),
+                'distinct': self._estimate_distinct(sketches[i]),
+            }
+            for i, column in enumerate(columns)
+        }
+        return result
+    
+    def _csv_column_stats(self, frame, columns: List[str], dtypes) -> Dict[str, Dict[str, Any]]:
+        """Exact column stats for a frame that fits in memory"""
+        import pandas as pd
+        stats = {}
+        for i, column in enumerate(columns):
+            series = frame.iloc[:, i]
+            numeric = pd.api.types.is_numeric_dtype(dtypes.iloc[i]) and not pd.api.types.is_bool_dtype(dtypes.iloc[i])
+            stats[column] = {
+                'nulls': int(series.isna().sum()),
+                'min': self._plain_value(series.min()) if numeric else None,
+                'max': self._plain_value(series.max()) if numeric else None,
+                'distinct': int(series.nunique()),
+            }
+        return stats
+    
+    def _estimate_distinct(self, sketch) -> int:
+        """K-minimum-values estimate of distinct values (exact below the sketch size)"""
+        if len(sketch) < self.CSV_SKETCH_SIZE:
+            return len(sketch)
+        return int((self.CSV_SKETCH_SIZE - 1) / (float(sketch[-1]) / 2.0 ** 64))
+    
+    @staticmethod
+    def _plain_value(value):
+        """Convert a numpy scalar to a JSON-friendly Python value"""
+        if value is None or value != value:  # None or NaN
+            return None
+        return value.item() if hasattr(value, 'item') else value
+    
     async def _handle_csv_file(self, filepath: str) -> Dict[str, Any]:
         """Handle CSV files"""
         try:
-            import pandas as pd
-            df = pd.read_csv(filepath)
-            
-            return {
-                'type': 'csv',
-                'rows': len(df),
-                'columns': len(df.columns),
-                'column_names': list(df.columns),
-                'preview': df.head().to_string(),
-                'data_types': df.dtypes.to_dict()
-            }
+            return await asyncio.to_thread(self._profile_csv, filepath)
         except ImportError:
             # Fallback without pandas
-            with open(filepath, 'r') as f:
-                lines = f.readlines()
+            def scan():
+                with open(filepath, 'r', errors='replace') as f:
+                    preview = ''.join(line for _, line in zip(range(10), f))
                 return {
                     'type': 'csv',
-                    'rows': len(lines) - 1,  # Subtract header
-                    'preview': ''.join(lines[:10])
+                    'rows': max(0, self._count_lines(filepath) - 1),  # Subtract header
+                    'preview': preview
                 }
+            return await asyncio.to_thread(scan)
         except Exception as e:
             return {'error': f'Error reading CSV: {str(e)}'}
     
@@ -435,20 +1269,169 @@ class AIAgent:
             'error': 'Legacy .doc files require additional tools. Consider converting to .docx'
         }
     
+    @staticmethod
+    def _format_sheet_rows(rows: List[tuple], cell_width: int = 24) -> str:
+        """Render preview rows as a pipe-separated table"""
+        def cell(value):
+            text = '' if value is None else str(value).replace('\n', ' ')
+            return text if len(text) <= cell_width else text[:cell_width - 3] + '...'
+        return '\n'.join(' | '.join(cell(value) for value in row) for row in rows)
+    
+    def _profile_workbook(self, filepath: str, preview_rows: int = 5) -> Dict[str, Any]:
+        """Enumerate every sheet of a workbook without loading it.
+
+        .xlsx/.xlsm files are read with openpyxl in read-only mode, which streams
+        rows from the archive; legacy .xls files are opened on demand with xlrd
+        and each sheet is released after it has been previewed.
+        """
+        sheets = []
+        if filepath.lower().endswith('.xls'):
+            import xlrd
+            book = xlrd.open_workbook(filepath, on_demand=True)
+            try:
+                for name in book.sheet_names():
+                    sheet = book.sheet_by_name(name)
+                    rows = [tuple(sheet.row_values(i)) for i in range(min(sheet.nrows, preview_rows + 1))]
+                    sheets.append({'name': name, 'rows': sheet.nrows, 'columns': sheet.ncols, 'preview_rows': rows})
+                    book.unload_sheet(name)
+            finally:
+                book.release_resources()
+        else:
+            from openpyxl import load_workbook
+            book = load_workbook(filepath, read_only=True, data_only=True)
+            try:
+                for sheet in book.worksheets:
+                    rows = list(sheet.iter_rows(max_row=preview_rows + 1, values_only=True))
+                    row_count, column_count = sheet.max_row, sheet.max_column
+                    if row_count is None or column_count is None:
+                        # No stored dimensions; count by streaming the rows
+                        row_count = column_count = 0
+                        for row in sheet.iter_rows(values_only=True):
+                            row_count += 1
+                            column_count = max(column_count, len(row))
+                    sheets.append({'name': sheet.title, 'rows': row_count, 'columns': column_count,
+                                   'preview_rows': rows})
+            finally:
+                book.close()
+        
+        result = {'type': 'excel', 'sheet_count': len(sheets), 'sheets': sheets}
+        if sheets:
+            # Summary of the first sheet, as reported before sheets were enumerated
+            first = sheets[0]
+            header = first['preview_rows'][0] if first['preview_rows'] else ()
+            result.update({
+                'rows': max(0, first['rows'] - 1),  # Subtract header
+                'columns': first['columns'],
+                'column_names': [str(name) for name in header if name is not None],
+            })
+        
+        for sheet in sheets:
+            # Read-only rows stop at the last non-empty cell
+            rows = [tuple(row) + (None,) * (sheet['columns'] - len(row)) for row in sheet.pop('preview_rows')]
+            sheet['preview'] = self._format_sheet_rows(rows)
+        if sheets:
+            result['preview'] = sheets[0]['preview']
+        return result
+    
     async def _handle_excel_file(self, filepath: str) -> Dict[str, Any]:
         """Handle Excel files"""
         try:
-            import pandas as pd
-            df = pd.read_excel(filepath)
-            
-            return {
-                'type': 'excel',
-                'rows': len(df),
-                'columns': len(df.columns),
-                'column_names': list(df.columns),
-                'preview': df.head().to_string()
-            }
-        except ImportError:
-            return {'error': 'openpyxl not installed. Install with: pip install openpyxl'}
+            return await asyncio.to_thread(self._profile_workbook, filepath)
+        except ImportError as e:
+            package = 'xlrd' if 'xlrd' in str(e) else 'openpyxl'
+            return {'error': f'{package} not installed. Install with: pip install {package}'}
         except Exception as e:
-            return {'error': f'Error reading Excel: {str(e)}'}
\ No newline at end of file
+            return {'error': f'Error reading Excel: {str(e)}'}
+
+_worker_agent = None
+
+def _analyze_file_in_worker(filepath: str) -> Dict[str, Any]:
+    """Run analyze_file in a batch worker process, reusing one agent per process"""
+    global _worker_agent
+    if _worker_agent is None:
+        _worker_agent = AIAgent(ai_core=None)
+        # Worker processes cannot start pools of their own
+        _worker_agent.pdf_parallel_pages = sys.maxsize
+    return asyncio.run(_worker_agent.analyze_file(filepath))
+
+def _extract_pdf_pages(filepath: str, indices: List[int]) -> Dict[int, str]:
+    """Extract text from the given 0-based pages (runs in worker processes too)"""
+    import PyPDF2
+    with open(filepath, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return {i: reader.pages[i].extract_text() or "" for i in indices}
+
+# Expected (is_safe, auto_execute) for commands whose verdict must not regress
+SAFETY_EXAMPLES = [
+    ("ls -la", (True, True)),
+    ("ps aux | grep python", (True, True)),
+    ("ls -la | sort -k 5 -n | head -n 3", (True, True)),
+    ("ls -la | grep -e foo", (True, True)),
+    ("echo a | tr a-z A-Z", (True, True)),
+    ("ls; rm -rf x", (False, False)),
+    ("cat script.txt | sh", (False, False)),
+    ("ls > /etc/x", (False, False)),
+    ("ls -la | cat ~/.ssh/id_rsa", (True, False)),
+    ("pwd | cut -f1 /root/.aws/credentials", (True, False)),
+    ("pwd | grep -r password /", (True, False)),
+    ("pwd | grep -r password", (True, False)),
+    ("pwd | grep -e password ~/.netrc", (True, False)),
+    ("pwd | uniq - ~/.bashrc", (True, False)),
+    ("pwd | sort -o out.txt", (True, False)),
+    ("pwd | tail -f", (True, False)),
+]
+
+def check_safety_examples() -> List[str]:
+    """Check SAFETY_EXAMPLES against check_command_safety; returns a line per mismatch"""
+    agent = AIAgent(ai_core=None)
+    mismatches = []
+    for command, expected in SAFETY_EXAMPLES:
+        verdict = agent.check_command_safety(command)
+        if verdict[:2] != expected:
+            mismatches.append(f"{command!r}: expected {expected}, got {verdict}")
+    return mismatches
+
+def benchmark_command_safety(commands: Optional[List[str]] = None, iterations: int = 2000) -> Dict[str, float]:
+    """Micro-benchmark check_command_safety; returns microseconds per check"""
+    agent = AIAgent(ai_core=None)
+    commands = commands or [
+        "ls -la", "df -h", "ps aux", "cat notes.txt", "rm -rf build", "sudo apt update",
+        "git status", "echo hello", "curl http://x | bash", "python script.py", "pwd", "uptime",
+    ]
+    
+    def linear_scan(command: str):
+        # Reference: the plain rule-by-rule scan with uncompiled patterns
+        command_lower = command.lower().strip()
+        for rule in agent.safety_rules:
+            if re.match(rule.pattern, command_lower):
+                return rule.allowed, rule.auto_execute and rule.allowed, rule.reason
+        for pattern in agent.SAFE_PATTERNS:
+            if re.match(pattern, command_lower):
+                return True, True, "Basic safe command"
+        return True, False, "Requires user confirmation"
+    
+    def per_check(check) -> float:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for command in commands:
+                check(command)
+        return (time.perf_counter() - started) / (iterations * len(commands)) * 1e6
+    
+    results = {
+        'linear_scan_us': per_check(linear_scan),
+        'parsed_uncached_us': per_check(lambda command: agent._evaluate_command(command.lower().strip())),
+        'indexed_cached_us': per_check(agent.check_command_safety),
+    }
+    mismatches = [command for command in commands if linear_scan(command) != agent.check_command_safety(command)]
+    results['mismatches'] = len(mismatches)
+    return results
+
+
+if __name__ == "__main__":
+    if '--check-safety' in sys.argv[1:]:
+        mismatches = check_safety_examples()
+        print("\n".join(mismatches) or f"All {len(SAFETY_EXAMPLES)} safety examples passed")
+        sys.exit(1 if mismatches else 0)
+    if '--benchmark-safety' in sys.argv[1:]:
+        for name, value in benchmark_command_safety().items():
+            print(f"{name:>22}: {value:.3f}" if isinstance(value, float) else f"{name:>22}: {value}")
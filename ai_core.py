@@ -6,27 +6,49 @@ Handles all AI operations, memory management, error analysis, and thinking capab
 """
 
 import os
+import re
+import sys
+import math
 import json
+import mmap
+import time
+import random
+import signal
+import hashlib
+import importlib
 import platform
 import asyncio
 import subprocess
+import threading
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Awaitable, Callable, Iterable
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 try:
-    import google.generativeai as genai
-    import openai
     from dotenv import load_dotenv
 except ImportError:
     import subprocess
     import sys
-    subprocess.run([sys.executable, "-m", "pip", "install", "google-generativeai", "openai", "python-dotenv"], check=True)
-    import google.generativeai as genai
-    import openai
+    subprocess.run([sys.executable, "-m", "pip", "install", "python-dotenv"], check=True)
     from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, journal appends are still atomic enough
+    fcntl = None
+
+def _import_sdk(module: str, package: str):
+    """Import a provider SDK on first use, installing it if missing"""
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        subprocess.run([sys.executable, "-m", "pip", "install", package], check=True)
+        return importlib.import_module(module)
+
 @dataclass
 class AIResponse:
     """Response from AI with commands and metadata"""
@@ -51,45 +73,1018 @@ class ThinkingStep:
     output: str
     reasoning: str
     next_action: str
+    duration: float = 0.0
+
+@dataclass
+class IntentRule:
+    """Local rule mapping a request pattern directly to commands (no AI call)"""
+    pattern: str
+    commands: List[str]
+    message: str
+    confidence: float = 0.95
+    regex: Any = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.regex = re.compile(self.pattern, re.IGNORECASE)
+
+class StreamingJSONExtractor:
+    """Incrementally extract fields from a streamed JSON response.
+
+    Feed raw text chunks as they arrive; each call to feed() returns a list of
+    (field, value) events. String fields (e.g. "message") are reported with
+    their value so far every time it grows, list fields (e.g. "commands") are
+    reported once per entry as soon as that entry is complete.
+    """
+
+    _ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+    def __init__(self, string_fields: Iterable[str] = ('message',),
+                 list_fields: Iterable[str] = ('commands', 'exploration_commands')):
+        self.string_fields = set(string_fields)
+        self.list_fields = set(list_fields)
+        self.text = ""
+        self.values: Dict[str, Any] = {}
+        self.finished = False
+        self._started = False
+        self._stack: List[str] = []
+        self._expect_key = True
+        self._key: Optional[str] = None
+        self._in_string = False
+        self._escape = False
+        self._unicode: Optional[str] = None
+        self._role: Optional[str] = None
+        self._chars: List[str] = []
+        self._raw: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk of text and return the events it completes"""
+        self.text += chunk
+        events = []
+        for ch in chunk:
+            if self.finished:
+                break
+            event = self._consume(ch)
+            if event:
+                # Collapse consecutive partial updates of the same string field
+                if events and events[-1][0] == event[0] and event[0] in self.string_fields:
+                    events[-1] = event
+                else:
+                    events.append(event)
+        return events
+
+    def _consume(self, ch: str) -> Optional[Tuple[str, Any]]:
+        if not self._started:
+            if ch == '{':
+                self._started = True
+                self._stack.append(ch)
+            return None
+
+        if self._in_string:
+            return self._consume_string_char(ch)
+
+        if ch == '"':
+            self._start_string()
+        elif ch in '{[':
+            self._stack.append(ch)
+        elif ch in '}]':
+            if self._stack:
+                self._stack.pop()
+            if not self._stack:
+                self.finished = True
+        elif len(self._stack) == 1:
+            if ch == ':':
+                self._expect_key = False
+            elif ch == ',':
+                self._expect_key = True
+                self._key = None
+        return None
+
+    def _start_string(self):
+        self._in_string = True
+        self._chars = []
+        self._raw = []
+        depth = len(self._stack)
+        if depth == 1 and self._expect_key:
+            self._role = 'key'
+        elif depth == 1 and self._key in self.string_fields:
+            self._role = 'string'
+        elif depth == 2 and self._stack[-1] == '[' and self._key in self.list_fields:
+            self._role = 'item'
+        else:
+            self._role = None
+
+    def _consume_string_char(self, ch: str) -> Optional[Tuple[str, Any]]:
+        if ch == '"' and not self._escape and self._unicode is None:
+            self._in_string = False
+            return self._end_string()
+
+        self._raw.append(ch)
+        if self._unicode is not None:
+            self._unicode += ch
+            if len(self._unicode) < 4:
+                return None
+            try:
+                self._chars.append(chr(int(self._unicode, 16)))
+            except ValueError:
+                pass
+            self._unicode = None
+        elif self._escape:
+            self._escape = False
+            if ch == 'u':
+                self._unicode = ""
+                return None
+            self._chars.append(self._ESCAPES.get(ch, ch))
+        elif ch == '\\':
+            self._escape = True
+            return None
+        else:
+            self._chars.append(ch)
+
+        if self._role == 'string':
+            value = ''.join(self._chars)
+            self.values[self._key] = value
+            return self._key, value
+        return None
+
+    def _end_string(self) -> Optional[Tuple[str, Any]]:
+        raw = ''.join(self._raw)
+        try:
+            value = json.loads(f'"{raw}"')
+        except ValueError:
+            value = ''.join(self._chars)
+
+        if self._role == 'key':
+            self._key = value
+        elif self._role == 'string':
+            self.values[self._key] = value
+            return self._key, value
+        elif self._role == 'item':
+            self.values.setdefault(self._key, []).append(value)
+            return self._key, value
+        return None
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate (about 4 characters per token for English and code)"""
+    return (len(text) + 3) // 4
+
+@dataclass
+class ContextBudget:
+    """Token budget per context prompt section.
+
+    Sections are filled in priority order (history, memory, system info) and
+    budget a section leaves unused is passed on to the next one.
+    """
+    history: int = 800
+    memory: int = 600
+    system: int = 200
+
+    @classmethod
+    def from_env(cls) -> 'ContextBudget':
+        """Read overrides from NLSHELL_CONTEXT_*_TOKENS environment variables"""
+        defaults = cls()
+        return cls(
+            history=int(os.getenv('NLSHELL_CONTEXT_HISTORY_TOKENS', defaults.history)),
+            memory=int(os.getenv('NLSHELL_CONTEXT_MEMORY_TOKENS', defaults.memory)),
+            system=int(os.getenv('NLSHELL_CONTEXT_SYSTEM_TOKENS', defaults.system)),
+        )
+
+class MemoryJournal:
+    """Append-only JSON-lines store for persistent memory.
+
+    Each saved sentence is appended as one line while holding an exclusive
+    lock on a separate lock file, so concurrent shells never clobber each
+    other's entries and compaction can atomically replace the journal.
+    Loading reads the file through mmap.
+    """
+
+    def __init__(self, path: Path, legacy_path: Optional[Path] = None, compact_slack: int = 100):
+        self.path = Path(path)
+        self.legacy_path = legacy_path
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self.compact_slack = compact_slack  # duplicate lines tolerated before compacting
+        self._offset = 0
+        self._inode = None
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self, offset: int) -> Tuple[List[Any], int]:
+        """Parse entries after offset; returns (entries, unreadable_lines) and advances the offset"""
+        entries = []
+        bad_lines = 0
+        try:
+            with open(self.path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                self._inode = stat.st_ino
+                if stat.st_size <= offset:
+                    self._offset = stat.st_size
+                    return entries, bad_lines
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    mm.seek(offset)
+                    for line in iter(mm.readline, b''):
+                        if not line.strip():
+                            continue
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            bad_lines += 1
+                    self._offset = mm.tell()
+        except FileNotFoundError:
+            self._inode = None
+            self._offset = 0
+        return entries, bad_lines
+
+    def _write_all(self, entries: List[Any]):
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> List[Any]:
+        """Load all entries, migrating the legacy JSON file and compacting when needed"""
+        with self._locked():
+            if not self.path.exists() and self.legacy_path and self.legacy_path.exists():
+                with open(self.legacy_path, 'r') as f:
+                    data = json.load(f)
+                if isinstance(data, list):
+                    self._write_all(data)
+                    self.legacy_path.rename(self.legacy_path.with_name(self.legacy_path.name + '.migrated'))
+
+            entries, bad_lines = self._read(0)
+            unique = list(dict.fromkeys(json.dumps(entry) for entry in entries))
+            if bad_lines or len(entries) - len(unique) > self.compact_slack:
+                entries = [json.loads(entry) for entry in unique]
+                self._write_all(entries)
+                self._read(0)
+            return entries
+
+    def append(self, entry: Any) -> Tuple[List[Any], bool]:
+        """Append an entry; returns (entries to add, reset).
+
+        The entries include any appended by other shells since the last read,
+        followed by this one. If the journal was compacted meanwhile, reset is
+        True and the entries are the complete contents.
+        """
+        with self._locked():
+            try:
+                stat = os.stat(self.path)
+                reset = stat.st_ino != self._inode or stat.st_size < self._offset
+            except FileNotFoundError:
+                reset = self._offset > 0
+            new_entries, _ = self._read(0 if reset else self._offset)
+
+            with open(self.path, 'ab') as f:
+                # Terminate a line torn by a crashed writer before appending
+                if f.tell() > 0:
+                    with open(self.path, 'rb') as check:
+                        check.seek(-1, os.SEEK_END)
+                        if check.read(1) != b'\n':
+                            f.write(b'\n')
+                f.write((json.dumps(entry) + '\n').encode('utf-8'))
+                self._offset = f.tell()
+            self._inode = os.stat(self.path).st_ino
+
+            return new_entries + [entry], reset
+
+class MemoryIndex:
+    """Local BM25 index over persistent memory sentences.
+
+    Documents are added incrementally; search() ranks them against a free-text
+    query without any network access.
+    """
+
+    _TOKEN_RE = re.compile(r'[a-z0-9_]+')
+    _STOPWORDS = frozenset((
+        'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'do', 'for', 'from', 'how', 'i', 'in',
+        'is', 'it', 'me', 'my', 'of', 'on', 'or', 'show', 'that', 'the', 'this', 'to', 'what',
+        'where', 'which', 'with', 'you',
+    ))
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs: List[Dict[str, int]] = []
+        self.doc_lengths: List[int] = []
+        self.doc_freqs: Dict[str, int] = {}
+        self.postings: Dict[str, List[int]] = {}
+        self.total_length = 0
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return [token for token in cls._TOKEN_RE.findall(str(text).lower()) if token not in cls._STOPWORDS]
+
+    def add(self, text: str) -> int:
+        """Index a document and return its id (ids follow insertion order)"""
+        doc_id = len(self.term_freqs)
+        freqs: Dict[str, int] = {}
+        tokens = self.tokenize(text)
+        for token in tokens:
+            freqs[token] = freqs.get(token, 0) + 1
+        for token in freqs:
+            self.doc_freqs[token] = self.doc_freqs.get(token, 0) + 1
+            self.postings.setdefault(token, []).append(doc_id)
+        self.term_freqs.append(freqs)
+        self.doc_lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        return doc_id
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Return up to k (doc_id, score) pairs with a positive score, best first"""
+        n = len(self.term_freqs)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1.0
+        scores: Dict[int, float] = {}
+        for token in set(self.tokenize(query)):
+            docs = self.postings.get(token)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id in docs:
+                tf = self.term_freqs[doc_id][token]
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[:k]
+
+@dataclass
+class OutputLimits:
+    """How much command output is kept (head/tail windows) and when a producer is stopped"""
+    head_bytes: int = 16384
+    tail_bytes: int = 4096
+    head_lines: int = 200
+    tail_lines: int = 50
+    max_bytes: int = 8 * 1024 * 1024  # total output after which the command is stopped (0 = never)
+
+    @classmethod
+    def from_env(cls) -> 'OutputLimits':
+        """Read overrides from NLSHELL_OUTPUT_* environment variables"""
+        defaults = cls()
+        return cls(
+            head_bytes=int(os.getenv('NLSHELL_OUTPUT_HEAD_BYTES', defaults.head_bytes)),
+            tail_bytes=int(os.getenv('NLSHELL_OUTPUT_TAIL_BYTES', defaults.tail_bytes)),
+            head_lines=int(os.getenv('NLSHELL_OUTPUT_HEAD_LINES', defaults.head_lines)),
+            tail_lines=int(os.getenv('NLSHELL_OUTPUT_TAIL_LINES', defaults.tail_lines)),
+            max_bytes=int(os.getenv('NLSHELL_OUTPUT_MAX_BYTES', defaults.max_bytes)),
+        )
+
+class CappedOutput:
+    """Bounded buffer that keeps the head and tail of a byte stream and counts the rest"""
+
+    def __init__(self, limits: OutputLimits):
+        self.limits = limits
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+        self.total_lines = 0
+        self.stopped = False
+
+    def feed(self, data: bytes):
+        self.total_bytes += len(data)
+        self.total_lines += data.count(b'\n')
+
+        room = self.limits.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data and self.limits.tail_bytes > 0:
+            self.tail += data
+            if len(self.tail) > self.limits.tail_bytes:
+                del self.tail[:len(self.tail) - self.limits.tail_bytes]
+
+    @property
+    def dropped_bytes(self) -> int:
+        return self.total_bytes - len(self.head) - len(self.tail)
+
+    def render(self) -> str:
+        """Decode the kept windows, with a marker describing what was dropped"""
+        limits = self.limits
+        if self.dropped_bytes == 0:
+            lines = (self.head + self.tail).decode('utf-8', errors='replace').splitlines(keepends=True)
+            if len(lines) <= limits.head_lines + limits.tail_lines and not self.stopped:
+                return ''.join(lines)
+            head_lines, tail_lines = lines[:limits.head_lines], lines[limits.head_lines:]
+        else:
+            head_lines = self.head.decode('utf-8', errors='replace').splitlines(keepends=True)
+            tail_lines = self.tail.decode('utf-8', errors='replace').splitlines(keepends=True)
+
+        kept_head = ''.join(head_lines[:limits.head_lines])
+        kept_tail = ''.join(tail_lines[-limits.tail_lines:]) if limits.tail_lines > 0 else ''
+        omitted_bytes = max(0, self.total_bytes - len(kept_head.encode()) - len(kept_tail.encode()))
+        omitted_lines = max(0, self.total_lines - kept_head.count('\n') - kept_tail.count('\n'))
+
+        parts = [kept_head.rstrip('\n')]
+        if omitted_bytes:
+            parts.append(f"[... {omitted_bytes:,} bytes ({omitted_lines:,} lines) truncated ...]")
+        if kept_tail:
+            parts.append(kept_tail.rstrip('\n'))
+        if self.stopped:
+            parts.append(f"[output limit reached: command stopped after {self.total_bytes:,} bytes]")
+        return '\n'.join(part for part in parts if part) + '\n'
+
+# Process groups of capped commands that are still running
+_running_process_groups = set()
+
+def interrupt_running_commands(sig: int = signal.SIGINT):
+    """Forward a signal (Ctrl+C by default) to every running capped command"""
+    for pgid in list(_running_process_groups):
+        try:
+            os.killpg(pgid, sig)
+        except (ProcessLookupError, PermissionError):
+            _running_process_groups.discard(pgid)
+
+def _foreground_terminal() -> Optional[int]:
+    """File descriptor of the controlling terminal if this process is in its foreground"""
+    try:
+        fd = sys.stdin.fileno()
+        if os.isatty(fd) and os.tcgetpgrp(fd) == os.getpgrp():
+            return fd
+    except (AttributeError, ValueError, OSError):
+        pass
+    return None
+
+def _hand_terminal(fd: int, pgid: int):
+    """Make pgid the terminal's foreground process group"""
+    try:
+        # tcsetpgrp from a background group raises SIGTTOU unless it is ignored
+        previous = signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+    except ValueError:
+        return  # signal handlers can only be changed from the main thread
+    try:
+        os.tcsetpgrp(fd, pgid)
+    except OSError:
+        pass
+    finally:
+        signal.signal(signal.SIGTTOU, previous)
+
+def _echo(stream, chunk: bytes):
+    """Write a command's raw output to one of our own streams"""
+    try:
+        if hasattr(stream, 'buffer'):
+            stream.buffer.write(chunk)
+        else:
+            stream.write(chunk.decode('utf-8', errors='replace'))
+        stream.flush()
+    except (OSError, ValueError):
+        pass
+
+async def run_capped_command(command: str, cwd: str, limits: OutputLimits,
+                             detach: bool = True) -> Tuple[int, str, str]:
+    """Run a shell command keeping only a bounded window of its stdout/stderr.
+
+    Detached commands (exploration and agent probes) run in their own
+    session, away from the terminal, and the whole pipeline is killed once
+    the combined output exceeds limits.max_bytes. Other commands are the
+    user's own: they stay in the shell's session and hold the terminal's
+    foreground while they run, so password prompts (sudo, ssh, gpg) can
+    still read from it, and they run to completion with their output
+    streamed to our stdout/stderr. The returned window is only the copy kept
+    for prompts and history.
+    """
+    terminal = None if detach else _foreground_terminal()
+    if detach:
+        group = {'start_new_session': True}
+    elif sys.version_info >= (3, 11):
+        group = {'process_group': 0}
+    else:
+        # preexec_fn is not safe while other threads (the client warm-up) are running
+        group = {'preexec_fn': os.setpgrp}
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        **group
+    )
+    if terminal is not None:
+        _hand_terminal(terminal, process.pid)
+        try:
+            # Resume the command in case it touched the terminal before it was handed over
+            os.killpg(process.pid, signal.SIGCONT)
+        except (ProcessLookupError, PermissionError):
+            pass
+    _running_process_groups.add(process.pid)
+    stdout, stderr = CappedOutput(limits), CappedOutput(limits)
+
+    def stop():
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def pump(stream: asyncio.StreamReader, sink: CappedOutput, echo_to):
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                return
+            sink.feed(chunk)
+            if echo_to is not None:
+                _echo(echo_to, chunk)
+            elif (limits.max_bytes and not sink.stopped
+                    and stdout.total_bytes + stderr.total_bytes > limits.max_bytes):
+                stdout.stopped = stderr.stopped = True
+                stop()
+
+    try:
+        await asyncio.gather(pump(process.stdout, stdout, None if detach else sys.stdout),
+                             pump(process.stderr, stderr, None if detach else sys.stderr))
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        stop()
+        raise
+    finally:
+        _running_process_groups.discard(process.pid)
+        if terminal is not None:
+            _hand_terminal(terminal, os.getpgrp())
+    return returncode, stdout.render(), stderr.render()
+
+class JsonFileCache:
+    """Directory of JSON entries, one file per key.
+
+    Writes are atomic (temporary file + os.replace) and reading an entry
+    touches it, so the least recently used entries are evicted first once
+    the directory holds more than `max_entries` files or `max_bytes` bytes
+    (0 means no byte limit).
+    """
+
+    def __init__(self, directory: Path, max_entries: int = 500, max_bytes: int = 0):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash_key(*parts: Any) -> str:
+        """Hash the parts of a key into a file name"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the value stored under key, or None on a miss"""
+        return self.record(self.peek(key))
+
+    def peek(self, key: str) -> Optional[Any]:
+        """Like get, without counting a hit or miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+            if not self._is_fresh(value):
+                path.unlink(missing_ok=True)
+                return None
+            # Touch the entry so eviction sees it as recently used
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return value
+
+    def record(self, value: Optional[Any]) -> Optional[Any]:
+        """Count one lookup as a hit or miss; returns value"""
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def _is_fresh(self, value: Any) -> bool:
+        return True
+
+    def put(self, key: str, value: Any):
+        """Store a value, evicting least recently used entries if needed"""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(key)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump(value, f, default=str)
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError:
+            pass
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        try:
+            for path in self.directory.glob('*.json'):
+                try:
+                    file_stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((file_stat.st_mtime, file_stat.st_size, path))
+        except OSError:
+            pass
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        entries.sort()
+        for _, size, path in entries:
+            if count <= self.max_entries and (not self.max_bytes or total <= self.max_bytes):
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            count -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        entries = self._entries()
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_entries': self.max_entries
+        }
+        if self.max_bytes:
+            stats['max_bytes'] = self.max_bytes
+        return stats
+
+class ResponseCache(JsonFileCache):
+    """On-disk, content-addressed cache of AI responses.
+
+    Each entry is stored in its own file named after the hash of the
+    normalized prompt and the provider/model that answered it. Entries expire
+    after `ttl` seconds and the least recently used ones are evicted once the
+    cache holds more than `max_entries`.
+    """
+
+    def __init__(self, directory: Path, ttl: float = 86400, max_entries: int = 500):
+        super().__init__(directory, max_entries)
+        self.ttl = ttl
+
+    @classmethod
+    def make_key(cls, prompt: str, provider: str, model: str) -> str:
+        """Hash a prompt (whitespace-normalized) together with provider and model"""
+        return cls.hash_key(provider, model, re.sub(r'\s+', ' ', prompt).strip())
+
+    def _is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry['created'] <= self.ttl
+
+    def peek(self, key: str) -> Optional[str]:
+        """Return the cached response for key without counting the lookup"""
+        entry = super().peek(key)
+        return entry['response'] if entry is not None else None
+
+    def put(self, key: str, response: str, provider: str, model: str):
+        """Store a response, evicting least recently used entries if needed"""
+        super().put(key, {
+            'created': time.time(),
+            'provider': provider,
+            'model': model,
+            'response': response
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        return dict(super().stats(), ttl_seconds=self.ttl)
+
+class CircuitBreaker:
+    """Remembers a failing provider so requests skip it for a while.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    `allow()` refuses calls. Once `reset_timeout` seconds have passed a single
+    half-open probe is let through: success closes the breaker again, failure
+    re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.probe_started = 0.0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if self.probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Whether a call may go to this provider now"""
+        state = self.state
+        if state == 'closed':
+            return True
+        # A probe that never reported back (e.g. a cancelled request) is given up after reset_timeout
+        if state == 'half-open' and (not self.probing or time.monotonic() - self.probe_started >= self.reset_timeout):
+            self.probing = True
+            self.probe_started = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute` tokens per minute (0 = unlimited)"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available"""
+        if not self.per_minute:
+            return 0.0
+        self._refill()
+        # A request larger than the whole bucket only has to wait for a full bucket
+        missing = min(amount, self.per_minute) - self.level
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, amount: float):
+        """Spend tokens; the level may go negative when actual usage exceeds the estimate"""
+        if self.per_minute:
+            self._refill()
+            self.level -= amount
+
+class ApiKeySlot:
+    """One API key with its rate limits, load and usage counters"""
+
+    def __init__(self, key: str, requests_per_minute: float, tokens_per_minute: float):
+        self.key = key
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.rate_limit_streak = 0
+        self.usage = {'requests': 0, 'tokens': 0, 'rate_limited': 0, 'errors': 0}
+
+    def wait_time(self, tokens: int) -> float:
+        return max(self.cooldown_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+class KeyPool:
+    """API keys of one provider, handed out least-loaded first within their rate limits.
+
+    Each key has token buckets for requests and tokens per minute. A key
+    that receives a 429 is benched with exponential back-off (or for the
+    server's Retry-After) so traffic moves to the other keys.
+    """
+
+    def __init__(self, keys: List[str], requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.slots = [ApiKeySlot(key, requests_per_minute, tokens_per_minute) for key in keys]
+
+    async def acquire(self, prompt_tokens: int) -> ApiKeySlot:
+        """Wait for a key with capacity and reserve one request plus the prompt's tokens on it"""
+        while True:
+            ready = [slot for slot in self.slots if slot.wait_time(prompt_tokens) == 0]
+            if ready:
+                slot = min(ready, key=lambda slot: (slot.in_flight, -slot.requests.level, -slot.tokens.level))
+                slot.requests.take(1)
+                slot.tokens.take(prompt_tokens)
+                slot.in_flight += 1
+                slot.usage['requests'] += 1
+                slot.usage['tokens'] += prompt_tokens
+                return slot
+            await asyncio.sleep(min(slot.wait_time(prompt_tokens) for slot in self.slots))
+
+    def release(self, slot: ApiKeySlot, response_tokens: int = 0, error: Optional[BaseException] = None):
+        """Return a key, charging the response's tokens and backing off after a 429"""
+        slot.in_flight -= 1
+        slot.tokens.take(response_tokens)
+        slot.usage['tokens'] += response_tokens
+        if error is None:
+            slot.rate_limit_streak = 0
+            return
+        retry_after = _rate_limit_delay(error)
+        if retry_after is None:
+            slot.usage['errors'] += 1
+            return
+        slot.usage['rate_limited'] += 1
+        slot.rate_limit_streak += 1
+        backoff = retry_after or min(60.0, 2.0 ** (slot.rate_limit_streak - 1))
+        slot.cooldown_until = time.monotonic() + backoff
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-key usage, with keys masked"""
+        return [
+            dict(slot.usage, key=f"...{slot.key[-4:]}", in_flight=slot.in_flight,
+                 cooling_down=slot.cooldown_until > time.monotonic())
+            for slot in self.slots
+        ]
+
+def _rate_limit_delay(error: Optional[BaseException]) -> Optional[float]:
+    """None if error isn't a rate limit; otherwise the server's Retry-After in seconds (0 if absent)"""
+    while error is not None:
+        status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+        if status == 429 or type(error).__name__ in ('RateLimitError', 'ResourceExhausted', 'TooManyRequests'):
+            headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+            try:
+                return float(headers.get('retry-after', 0))
+            except (TypeError, ValueError):
+                return 0.0
+        error = error.__cause__
+    return None
+
+def _read_api_keys(name: str) -> List[str]:
+    """Keys from NAME plus the comma-separated pool in NAMEs, without duplicates"""
+    keys = [os.getenv(name, '')] + os.getenv(f'{name}S', '').split(',')
+    return list(dict.fromkeys(key.strip() for key in keys if key.strip()))
+
+class LatencyTracker:
+    """Recent response times of one provider: an EWMA plus a window for percentiles"""
+
+    def __init__(self, alpha: float = 0.2, window: int = 50, min_samples: int = 5):
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+        self.ewma: Optional[float] = None
+        self.count = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.ewma = seconds if self.ewma is None else self.alpha * seconds + (1 - self.alpha) * self.ewma
+
+    def percentile(self, q: float) -> Optional[float]:
+        """q-th percentile of the window, or None until enough samples were seen"""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def stats(self) -> Dict[str, Any]:
+        p90 = self.percentile(90)
+        return {
+            'calls': self.count,
+            'ewma_ms': round(self.ewma * 1000) if self.ewma is not None else None,
+            'p90_ms': round(p90 * 1000) if p90 is not None else None
+        }
 
 class AICore:
+    # Model tier per call site (override with NLSHELL_MODEL_<SITE>)
+    SITE_MODEL_TIERS = {
+        'command': 'fast',
+        'thinking': 'fast',
+        'analysis': 'strong',
+        'error': 'fast',
+        'question': 'strong',
+        'agent': 'fast',
+        'default': 'fast',
+    }
+    
+    # Seconds a call may take per provider, by call site (override with NLSHELL_DEADLINE_<SITE>)
+    CALL_DEADLINES = {
+        'command': 20.0,
+        'thinking': 20.0,
+        'analysis': 45.0,
+        'error': 30.0,
+        'question': 45.0,
+        'agent': 45.0,
+        'default': 30.0,
+    }
+    
     def __init__(self):
         load_dotenv()
         
         # Initialize API clients
-        self.gemini_api_key = os.getenv('GEMINI_API_KEY')
-        self.openai_api_key = os.getenv('OPENAI_API_KEY')
+        # A pool of keys per provider may be given as GEMINI_API_KEYS / OPENAI_API_KEYS (comma-separated)
+        self.gemini_api_keys = _read_api_keys('GEMINI_API_KEY')
+        self.openai_api_keys = _read_api_keys('OPENAI_API_KEY')
+        self.gemini_api_key = self.gemini_api_keys[0] if self.gemini_api_keys else None
+        self.openai_api_key = self.openai_api_keys[0] if self.openai_api_keys else None
+        # Client-side rate limits per key (NLSHELL_<PROVIDER>_RPM / _TPM, 0 = unlimited)
+        self.key_pools = {
+            provider: KeyPool(
+                keys,
+                requests_per_minute=float(os.getenv(f'NLSHELL_{provider.upper()}_RPM', '0')),
+                tokens_per_minute=float(os.getenv(f'NLSHELL_{provider.upper()}_TPM', '0'))
+            )
+            for provider, keys in (('gemini', self.gemini_api_keys), ('openai', self.openai_api_keys))
+        }
         
         # Default to Gemini, fallback to OpenAI
         self.use_gemini = bool(self.gemini_api_key)
         
-        # Prepare OpenAI client if key is present (even if Gemini is primary) for fallback
+        self.gemini_model_name = os.getenv('NLSHELL_GEMINI_MODEL', 'gemini-1.5-flash')
+        self.openai_model_name = os.getenv('NLSHELL_OPENAI_MODEL', 'gpt-4o-mini')
+        
+        # Model routing: each call site uses a tier ('fast' or 'strong') or explicit models
+        self.model_tiers = {
+            'fast': {'gemini': self.gemini_model_name, 'openai': self.openai_model_name},
+            'strong': {
+                'gemini': os.getenv('NLSHELL_GEMINI_STRONG_MODEL', 'gemini-1.5-pro'),
+                'openai': os.getenv('NLSHELL_OPENAI_STRONG_MODEL', 'gpt-4o')
+            }
+        }
+        self.model_routes = {
+            site: self._parse_model_route(site, tier) for site, tier in self.SITE_MODEL_TIERS.items()
+        }
+        # End-to-end latency per call site, for tuning the routes
+        self.site_latency = {site: LatencyTracker() for site in self.model_routes}
+        
+        # Stream responses token by token (set NLSHELL_STREAM=0 to disable)
+        self.streaming = os.getenv('NLSHELL_STREAM', '1').lower() not in ('0', 'false', 'no', 'off')
+        
+        # Cache responses to identical prompts on disk (set NLSHELL_CACHE=0 to disable)
+        self.cache_dir = Path.home() / '.nlshell_cache'
+        # Tools found on PATH, keyed by a fingerprint of PATH; only the latest is kept
+        self.tools_cache = JsonFileCache(self.cache_dir / 'tools', max_entries=1)
+        self.response_cache = None
+        if os.getenv('NLSHELL_CACHE', '1').lower() not in ('0', 'false', 'no', 'off'):
+            self.response_cache = ResponseCache(
+                self.cache_dir / 'responses',
+                ttl=float(os.getenv('NLSHELL_CACHE_TTL', '86400')),
+                max_entries=int(os.getenv('NLSHELL_CACHE_MAX_ENTRIES', '500'))
+            )
+        
+        # Provider SDKs are imported on first use (see _ensure_gemini_model / _ensure_openai_client)
+        self.model = None
         self.client = None
+        self.http_client = None
+        # Clients for additional pool keys, created on first use
+        self._gemini_models = {}
+        self._openai_clients = {}
         self._openai_v1 = False
-        if self.openai_api_key:
-            # Try OpenAI v1 client, fall back to legacy SDK
-            try:
-                from openai import OpenAI as _OpenAI
-                self.client = _OpenAI(api_key=self.openai_api_key)
-                self._openai_v1 = True
-            except Exception:
-                # Legacy SDK path
-                openai.api_key = self.openai_api_key
-                self.client = openai
-                self._openai_v1 = False
+        self._client_lock = threading.Lock()
+        # Shared keep-alive HTTP pool for the OpenAI client
+        self.http_pool_size = max(1, int(os.getenv('NLSHELL_HTTP_POOL_SIZE', '10')))
+        self.http_keepalive = float(os.getenv('NLSHELL_HTTP_KEEPALIVE', '300'))
 
-        if self.use_gemini:
-            genai.configure(api_key=self.gemini_api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
-        elif self.client is not None:
-            # OpenAI only
-            pass
-        else:
+        if not self.gemini_api_key and not self.openai_api_key:
             raise ValueError("No API key found. Please set GEMINI_API_KEY or OPENAI_API_KEY in .env file")
         
+        # Failure handling: per-site deadlines, jittered retries and a breaker per provider
+        self.call_deadlines = {
+            site: float(os.getenv(f'NLSHELL_DEADLINE_{site.upper()}', default))
+            for site, default in self.CALL_DEADLINES.items()
+        }
+        self.ai_retries = max(0, int(os.getenv('NLSHELL_AI_RETRIES', '2')))
+        self.retry_base_delay = float(os.getenv('NLSHELL_AI_RETRY_DELAY', '0.5'))
+        self.retry_max_delay = 8.0
+        self.breakers = {
+            provider: CircuitBreaker(
+                failure_threshold=max(1, int(os.getenv('NLSHELL_BREAKER_FAILURES', '3'))),
+                reset_timeout=float(os.getenv('NLSHELL_BREAKER_RESET', '30'))
+            )
+            for provider in ('gemini', 'openai')
+        }
+        
+        # Latency-aware routing: prefer the faster provider (NLSHELL_ADAPTIVE_PROVIDER=1) and
+        # hedge slow calls by also asking the other provider after the first one's p90 (NLSHELL_HEDGE=1)
+        self.latency = {provider: LatencyTracker() for provider in ('gemini', 'openai')}
+        self.adaptive_provider = os.getenv('NLSHELL_ADAPTIVE_PROVIDER', '0').lower() not in ('0', 'false', 'no', 'off')
+        self.hedging = os.getenv('NLSHELL_HEDGE', '0').lower() not in ('0', 'false', 'no', 'off')
+        # Hedge delay until a provider has enough samples for a p90
+        self.hedge_default_delay = float(os.getenv('NLSHELL_HEDGE_DELAY', '2.0'))
+        
+        # Import SDKs and build clients in the background so the first request doesn't pay for it
+        # (set NLSHELL_WARMUP=0 to disable)
+        self._warmup_thread = None
+        if os.getenv('NLSHELL_WARMUP', '1').lower() not in ('0', 'false', 'no', 'off'):
+            self._warmup_thread = threading.Thread(target=self._warm_up_clients, name='nlshell-warmup', daemon=True)
+            self._warmup_thread.start()
+        
+        # Token budget for the context included in every prompt
+        self.context_budget = ContextBudget.from_env()
+        self.last_context_report = {}
+        
         # Memory management
         self.temp_memory = []  # Last 20 interactions
+        self.memory_journal = MemoryJournal(
+            Path.home() / '.nlshell_memory.jsonl',
+            legacy_path=Path.home() / '.nlshell_memory.json'
+        )
         self.persistent_memory = self._load_persistent_memory()
+        self.memory_index = MemoryIndex()
+        for sentence in self.persistent_memory:
+            self.memory_index.add(sentence)
+        # Number of memory entries considered for a prompt
+        self.memory_top_k = max(1, int(os.getenv('NLSHELL_MEMORY_TOP_K', '8')))
         
         # System context
         self.system_info = self._gather_system_info()
@@ -97,6 +1092,94 @@ class AICore:
         # Thinking state
         self.thinking_steps = []
         
+        # Size caps for captured command output
+        self.output_limits = OutputLimits.from_env()
+        
+        # Local fast path for common requests (set NLSHELL_FAST_PATH=0 to always ask the AI)
+        self.intent_rules = []
+        if os.getenv('NLSHELL_FAST_PATH', '1').lower() not in ('0', 'false', 'no', 'off'):
+            self.intent_rules = self._init_intent_rules()
+        
+        # Maximum number of exploration commands running at the same time
+        self.exploration_concurrency = max(1, int(os.getenv('NLSHELL_EXPLORE_CONCURRENCY', '4')))
+        
+    # Well-known directories the intent rules can navigate to
+    KNOWN_PLACES = {
+        'desktop': '~/Desktop',
+        'downloads': '~/Downloads',
+        'documents': '~/Documents',
+        'pictures': '~/Pictures',
+        'music': '~/Music',
+        'videos': '~/Videos',
+        'home': '~',
+    }
+
+    def _init_intent_rules(self) -> List[IntentRule]:
+        """Initialize local rules for requests that need no AI round trip"""
+        # Slots only accept plain path characters so they are safe to paste into commands
+        name = r'(?P<name>[\w.~/-]+)'
+        places = '|'.join(self.KNOWN_PLACES)
+        return [
+            # Listing and navigation
+            IntentRule(r'^(?:list|show)(?: all)?(?: the)? files(?: here| in (?:this|the current) (?:directory|folder))?$',
+                       ["ls -la"], "Listing files in the current directory", 0.98),
+            IntentRule(r'^(?:list|show)(?: all)? hidden files$',
+                       ["ls -la"], "Listing all files including hidden ones", 0.97),
+            IntentRule(rf'^(?:go|navigate|switch|change(?: directory)?)(?: back)? (?:to|into)(?: my| the)? (?P<place>{places})(?: folder| directory)?$',
+                       ["cd {place}"], "Changing to {place}", 0.98),
+            IntentRule(r'^(?:go|move|navigate) (?:back|up)(?: one| a)?(?: level| directory| folder)?$',
+                       ["cd .."], "Going up one directory", 0.97),
+            IntentRule(rf'^(?:go|navigate|change directory|cd) (?:to|into) {name}$',
+                       ["cd {name}"], "Changing to {name}", 0.9),
+            IntentRule(r'^(?:where am i|(?:show|print)(?: the)?(?: current| working)+ directory|current directory)$',
+                       ["pwd"], "Showing the current directory", 0.98),
+
+            # Creating files and folders
+            IntentRule(rf'^(?:create|make)(?: a)?(?: new)? (?:folder|directory|dir)(?: called| named)? {name}$',
+                       ["mkdir {name}"], "Creating folder {name}", 0.97),
+            IntentRule(rf'^(?:create|make)(?: a)?(?: new| an empty| empty)? file(?: called| named)? {name}$',
+                       ["touch {name}"], "Creating file {name}", 0.95),
+
+            # Building and packages
+            IntentRule(r'^compile (?P<stem>[\w./-]+)\.c$',
+                       ["gcc {stem}.c -o {stem}"], "Compiling {stem}.c", 0.95),
+            IntentRule(r'^install(?: the)?(?: python)? package (?P<package>[\w.\[\]-]+)$',
+                       ["pip install {package}"], "Installing Python package {package}", 0.95),
+
+            # Simple system info
+            IntentRule(r'^(?:who am i|(?:show|what is)(?: my)?(?: current)? user(?:name)?)$',
+                       ["whoami"], "Showing the current user", 0.98),
+            IntentRule(r"^(?:show|what'?s|what is)(?: the)?(?: current)? (?:date|time|date and time)$",
+                       ["date"], "Showing the current date and time", 0.98),
+            IntentRule(r'^(?:show )?git status$',
+                       ["git status"], "Showing git status", 0.98),
+            IntentRule(r'^clear(?: the)?(?: screen| terminal)?$',
+                       ["clear"], "Clearing the screen", 0.98),
+        ]
+
+    def _match_intent(self, user_input: str) -> Optional[AIResponse]:
+        """Answer a request from the local intent table, or None to fall through to the AI"""
+        if not self.intent_rules:
+            return None
+        
+        text = re.sub(r'\s+', ' ', user_input).strip()
+        text = re.sub(r'^(?:please|can you|could you)\s+', '', text, flags=re.IGNORECASE)
+        text = re.sub(r'(?:\s+please)?[\s.!?]*$', '', text, flags=re.IGNORECASE)
+        
+        for rule in self.intent_rules:
+            match = rule.regex.match(text)
+            if not match:
+                continue
+            slots = {key: value for key, value in match.groupdict().items() if value is not None}
+            if 'place' in slots:
+                slots['place'] = self.KNOWN_PLACES[slots['place'].lower()]
+            return AIResponse(
+                message=rule.message.format(**slots),
+                suggested_commands=[command.format(**slots) for command in rule.commands],
+                confidence=rule.confidence
+            )
+        return None
+
     def _gather_system_info(self) -> Dict[str, Any]:
         """Gather system information for better command generation"""
         info = {
@@ -111,69 +1194,172 @@ class AICore:
             'path_separator': os.sep,
         }
         
-        # Check for common tools
-        tools = {}
-        for tool in ['git', 'node', 'npm', 'docker', 'gcc', 'make', 'pip', 'conda','jupyter']:
-            tools[tool] = self._check_command_exists(tool)
-        info['available_tools'] = tools
+        # Check for common tools (override the list with NLSHELL_TOOLS=git,node,...)
+        default_tools = 'git,node,npm,docker,gcc,make,pip,conda,jupyter'
+        tools = [tool.strip() for tool in os.getenv('NLSHELL_TOOLS', default_tools).split(',') if tool.strip()]
+        info['available_tools'] = self._detect_tools(tools)
         
         return info
     
-    def _check_command_exists(self, command: str) -> bool:
-        """Check if a command exists in PATH"""
-        try:
-            import subprocess
-            result = subprocess.run(['which', command], capture_output=True, text=True)
-            return result.returncode == 0
-        except:
-            return False
-    
-    def _load_persistent_memory(self) -> Dict[str, Any]:
-        """Load persistent memory (list of sentences) from file"""
-        memory_file = Path.home() / '.nlshell_memory.json'
+    def _detect_tools(self, tools: List[str]) -> Dict[str, bool]:
+        """Check which tools are on PATH by scanning its directories in-process.
+
+        The result is cached on disk and reused until PATH, the tool list or
+        the modification time of any PATH directory changes.
+        """
+        path_dirs = list(dict.fromkeys(d for d in os.environ.get('PATH', '').split(os.pathsep) if d))
+        
+        fingerprint = hashlib.sha256()
+        fingerprint.update(','.join(tools).encode())
+        for directory in path_dirs:
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtime = -1
+            fingerprint.update(f"\0{directory}\0{mtime}".encode())
+        fingerprint = fingerprint.hexdigest()
+        
+        cached = self.tools_cache.get(fingerprint)
+        if cached is not None:
+            return cached
+        
+        def list_directory(directory: str) -> Dict[str, str]:
+            try:
+                with os.scandir(directory) as entries:
+                    return {entry.name: entry.path for entry in entries}
+            except OSError:
+                return {}
+        
+        # List PATH directories concurrently, each one exactly once
+        with ThreadPoolExecutor(max_workers=min(8, len(path_dirs) or 1)) as executor:
+            listings = list(executor.map(list_directory, path_dirs))
+        
+        executable = {}  # stat cache: path -> is an executable file
+        def is_executable(path: str) -> bool:
+            if path not in executable:
+                executable[path] = os.path.isfile(path) and os.access(path, os.X_OK)
+            return executable[path]
+        
+        found = {
+            tool: any(tool in listing and is_executable(listing[tool]) for listing in listings)
+            for tool in tools
+        }
+        
+        self.tools_cache.put(fingerprint, found)
+        return found
+    
+    def _load_persistent_memory(self) -> List[Any]:
+        """Load persistent memory (list of sentences) from the journal"""
         try:
-            if memory_file.exists():
-                with open(memory_file, 'r') as f:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        return data
+            return self.memory_journal.load()
         except Exception:
-            pass
-        return []  
+            return []
     
     def save_persistent_memory(self, sentence: str):
         """Append a sentence to persistent memory"""
-
-        self.persistent_memory.append(sentence)
-        memory_file = Path.home() / '.nlshell_memory.json'
         try:
-            with open(memory_file, 'w') as f:
-                json.dump(self.persistent_memory, f, indent=2)
+            entries, reset = self.memory_journal.append(sentence)
         except Exception as e:
             print(f"Error saving memory: {e}")
-
-  
-    def _build_context_prompt(self, current_dir: str, history: List[Dict]) -> str:
-        """Build context prompt with system info, memory, and history"""
+            entries, reset = [sentence], False
+        
+        # Pick up entries other shells saved meanwhile, keeping the index in step
+        if reset:
+            self.persistent_memory = []
+            self.memory_index = MemoryIndex()
+        for entry in entries:
+            self.persistent_memory.append(entry)
+            self.memory_index.add(entry)
+
+    @staticmethod
+    def _take_within_budget(items: List[str], budget: int, contiguous: bool = True) -> Tuple[List[str], int]:
+        """Pick items in order while they fit in budget tokens.
+
+        With contiguous=True selection stops at the first item that does not
+        fit, otherwise oversized items are skipped and smaller ones still packed.
+        """
+        chosen = []
+        used = 0
+        for item in items:
+            cost = estimate_tokens(item)
+            if used + cost > budget:
+                if contiguous:
+                    break
+                continue
+            chosen.append(item)
+            used += cost
+        return chosen, used
+    
+    def _select_memory(self, query: str, current_dir: str) -> List[Any]:
+        """Persistent memory entries worth sending, most relevant first.
+
+        Entries are ranked against the request and the current directory; when
+        nothing matches (or there is no request) the most recent ones are used.
+        """
+        if query:
+            hits = self.memory_index.search(f"{query} {current_dir}", self.memory_top_k)
+            if hits:
+                return [self.persistent_memory[doc_id] for doc_id, _ in hits]
+        return list(reversed(self.persistent_memory[-self.memory_top_k:]))
+    
+    def _build_context_prompt(self, current_dir: str, history: List[Dict], query: str = "") -> str:
+        """Build context prompt with system info, memory, and history within the token budget"""
+        budget = self.context_budget
+        
+        # Recent history has the highest priority: newest entries first, at most 10
+        entries = []
+        for item in reversed(history[-10:]):
+            entries.append(
+                f"Input: '{item.get('input', 'N/A')}'\n"
+                f"   Commands: {item.get('commands', [])}\n"
+                f"   Success: {item.get('success', False)}\n\n"
+            )
+        entries, history_used = self._take_within_budget(entries, budget.history)
+        entries.reverse()
+        history_text = f"RECENT HISTORY (last {len(entries)} commands):\n"
+        history_text += "".join(f"{i}. {entry}" for i, entry in enumerate(entries, 1))
+        
+        # Then persistent memory relevant to the request, packed into what is left
+        memory_budget = budget.memory + (budget.history - history_used)
+        chosen, memory_used = self._take_within_budget(
+            [json.dumps(sentence) for sentence in self._select_memory(query, current_dir)],
+            memory_budget, contiguous=False
+        )
+        selected_memory = [json.loads(sentence) for sentence in chosen]
+        if selected_memory:
+            memory_text = json.dumps(selected_memory, indent=2)
+            if len(selected_memory) < len(self.persistent_memory):
+                memory_text += f"\n(showing {len(selected_memory)} of {len(self.persistent_memory)} entries)"
+        else:
+            memory_text = "No persistent memory stored"
+        
+        # System info last; lines are already in order of importance
+        system_lines, _ = self._take_within_budget([
+            f"- OS: {self.system_info['os']} {self.system_info['os_version']}",
+            f"- Current Directory: {current_dir}",
+            f"- User: {self.system_info['user']}",
+            f"- Shell: {self.system_info['shell']}",
+            f"- Available Tools: {', '.join([tool for tool, available in self.system_info['available_tools'].items() if available])}",
+        ], budget.system + (memory_budget - memory_used), contiguous=False)
+        system_text = "SYSTEM INFO:\n" + "\n".join(system_lines)
+        
+        self.last_context_report = {
+            'history_tokens': estimate_tokens(history_text),
+            'memory_tokens': estimate_tokens(memory_text),
+            'system_tokens': estimate_tokens(system_text),
+            'history_entries': f"{len(entries)}/{min(len(history), 10)}",
+            'memory_entries': f"{len(selected_memory)}/{len(self.persistent_memory)}",
+        }
+        
         context = f"""You are an AI assistant helping with a natural language shell interface.
 
-SYSTEM INFO:
-- OS: {self.system_info['os']} {self.system_info['os_version']}
-- Current Directory: {current_dir}
-- User: {self.system_info['user']}
-- Shell: {self.system_info['shell']}
-- Available Tools: {', '.join([tool for tool, available in self.system_info['available_tools'].items() if available])}
+{system_text}
 
 PERSISTENT MEMORY:
-{json.dumps(self.persistent_memory, indent=2) if self.persistent_memory else "No persistent memory stored"}
+{memory_text}
 
-RECENT HISTORY (last {len(history)} commands):
-"""
-        for i, item in enumerate(history[-10:], 1):  # Show last 10 for context
-            context += f"{i}. Input: '{item.get('input', 'N/A')}'\n"
-            context += f"   Commands: {item.get('commands', [])}\n"
-            context += f"   Success: {item.get('success', False)}\n\n"
-        
+{history_text}"""
+        self.last_context_report['total_tokens'] = estimate_tokens(context)
         return context
 
     def _requires_thinking(self, user_input: str) -> bool:
@@ -217,72 +1403,508 @@ RECENT HISTORY (last {len(history)} commands):
                 # Don't change directory during thinking
                 return 1, "", "Cannot change directory during thinking phase"
             
-            process = await asyncio.create_subprocess_shell(
-                command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=current_dir
-            )
-            
-            stdout, stderr = await process.communicate()
-            return process.returncode, stdout.decode('utf-8'), stderr.decode('utf-8')
+            return await self.run_command(command, current_dir)
             
         except Exception as e:
             return 1, "", str(e)
 
-    async def _call_gemini(self, prompt: str) -> str:
+    async def run_command(self, command: str, cwd: str, detach: bool = True) -> Tuple[int, str, str]:
+        """Run a shell command with output capped by self.output_limits.
+
+        detach=False is for commands the user asked for: they keep the terminal,
+        run to completion and show their output as it is produced.
+        """
+        return await run_capped_command(command, cwd, self.output_limits, detach)
+    
+    def interrupt_commands(self):
+        """Interrupt running commands (detached ones live in their own session and miss the terminal's Ctrl+C)"""
+        interrupt_running_commands()
+
+    async def _run_exploration_commands(self, commands: List[str], current_dir: str) -> List[Tuple[int, str, str, float]]:
+        """Run read-only exploration commands concurrently (bounded by exploration_concurrency).
+
+        Returns (returncode, stdout, stderr, wall_time) per command, in the original order.
+        """
+        semaphore = asyncio.Semaphore(self.exploration_concurrency)
+        
+        async def run(command: str) -> Tuple[int, str, str, float]:
+            async with semaphore:
+                started = time.perf_counter()
+                returncode, stdout, stderr = await self._execute_thinking_command(command, current_dir)
+                return returncode, stdout, stderr, time.perf_counter() - started
+        
+        return await asyncio.gather(*(run(command) for command in commands))
+
+    def _parse_model_route(self, site: str, tier: str) -> Dict[str, str]:
+        """Models per provider for a call site from NLSHELL_MODEL_<SITE>.
+
+        The value is a tier name or "gemini:<model>,openai:<model>" (a provider
+        left out uses the fast tier). Anything else is ignored with a warning
+        and the site keeps its default tier.
+        """
+        variable = f'NLSHELL_MODEL_{site.upper()}'
+        value = os.getenv(variable, tier).strip()
+        if value.lower() in self.model_tiers:
+            return dict(self.model_tiers[value.lower()])
+        route = dict(self.model_tiers['fast'])
+        for part in (part.strip() for part in value.split(',')):
+            provider, _, model = part.partition(':')
+            provider, model = provider.strip().lower(), model.strip()
+            if provider not in route or not model:
+                print(f"Warning: ignoring {variable}={value!r}: expected one of "
+                      f"{', '.join(self.model_tiers)} or gemini:<model>,openai:<model>")
+                return dict(self.model_tiers[tier])
+            route[provider] = model
+        return route
+    
+    def _model_for(self, site: str, provider: str) -> str:
+        """Model a call site uses on a provider"""
+        return self.model_routes.get(site, self.model_routes['default'])[provider]
+    
+    async def _call_gemini(self, prompt: str, model_name: Optional[str] = None) -> str:
         """Call Gemini API"""
+        pool = self.key_pools['gemini']
+        slot = await pool.acquire(estimate_tokens(prompt))
         try:
-            response = await asyncio.to_thread(self.model.generate_content, prompt)
-            return response.text
+            model = self._gemini_model_for(slot.key, model_name or self.gemini_model_name)
+            response = await model.generate_content_async(prompt)
+            text = response.text
         except Exception as e:
-            if self.openai_api_key:
-                # Fallback to OpenAI
-                return await self._call_openai(prompt)
-            else:
-                raise Exception(f"Gemini API error: {e}")
+            pool.release(slot, error=e)
+            raise Exception(f"Gemini API error: {e}") from e
+        except BaseException:
+            pool.release(slot)  # cancelled: lost a hedge or ran out of time
+            raise
+        pool.release(slot, estimate_tokens(text))
+        return text
+    
+    def _gemini_model_for(self, key: str, model_name: str):
+        """Gemini model_name authenticated with key"""
+        self._ensure_gemini_model()
+        if key == self.gemini_api_key and model_name == self.gemini_model_name:
+            return self.model
+        with self._client_lock:
+            if (key, model_name) not in self._gemini_models:
+                import google.generativeai as genai
+                model = genai.GenerativeModel(model_name)
+                if key != self.gemini_api_key:
+                    self._bind_gemini_key(model, key)
+                self._gemini_models[key, model_name] = model
+            return self._gemini_models[key, model_name]
     
-    async def _call_openai(self, prompt: str) -> str:
+    @staticmethod
+    def _bind_gemini_key(model, key: str):
+        """Give a Gemini model its own async client for a pool key.
+
+        genai.configure holds a single key per process, so this replaces the
+        model's private _async_client (google-generativeai 0.3 - 0.8).
+        """
+        if not hasattr(model, '_async_client'):
+            import google.generativeai as genai
+            raise RuntimeError(
+                f"google-generativeai {getattr(genai, '__version__', '?')} has no GenerativeModel._async_client; "
+                "extra keys in GEMINI_API_KEYS need google-generativeai>=0.3,<0.9"
+            )
+        from google.ai import generativelanguage as glm
+        model._async_client = glm.GenerativeServiceAsyncClient(client_options={'api_key': key})
+    
+    def _ensure_gemini_model(self):
+        """Import the Gemini SDK and create the model on first use"""
+        with self._client_lock:
+            if self.model is not None:
+                return
+            genai = _import_sdk('google.generativeai', 'google-generativeai')
+            genai.configure(api_key=self.gemini_api_key)
+            # The async client keeps one gRPC channel open for all requests
+            self.model = genai.GenerativeModel(self.gemini_model_name)
+
+    def _ensure_openai_client(self):
+        """Import the OpenAI SDK and create the async client on first use"""
+        with self._client_lock:
+            if self.client is not None:
+                return
+            if not self.openai_api_key:
+                raise RuntimeError("OpenAI API key not configured")
+            openai = _import_sdk('openai', 'openai')
+            if hasattr(openai, 'AsyncOpenAI'):
+                # One pooled client for the whole session, so TLS is set up once and reused
+                client_class = getattr(openai, 'DefaultAsyncHttpxClient', None)
+                if client_class is not None:
+                    # The HTTP library the SDK is built on (httpx, or its renamed successor)
+                    http = importlib.import_module(client_class.__mro__[1].__module__.partition('.')[0])
+                    self.http_client = client_class(
+                        limits=http.Limits(
+                            max_connections=self.http_pool_size,
+                            max_keepalive_connections=self.http_pool_size,
+                            keepalive_expiry=self.http_keepalive
+                        ),
+                        timeout=http.Timeout(120.0, connect=10.0)
+                    )
+                # Retries are handled by _with_retries, so the SDK's own are turned off
+                self.client = openai.AsyncOpenAI(api_key=self.openai_api_key, http_client=self.http_client, max_retries=0)
+                self._openai_v1 = True
+            else:
+                # Legacy SDK path
+                openai.api_key = self.openai_api_key
+                self.client = openai
+                self._openai_v1 = False
+
+    def _warm_up_clients(self):
+        """Import the provider SDKs and build their clients (runs in a background thread)"""
+        try:
+            if self.gemini_api_key:
+                self._ensure_gemini_model()
+            if self.openai_api_key:
+                self._ensure_openai_client()
+        except Exception:
+            # Failures resurface, with a proper message, on the first real request
+            pass
+
+    def _openai_client_for(self, key: str):
+        """OpenAI client authenticated with key; all keys share one connection pool"""
+        self._ensure_openai_client()
+        if key == self.openai_api_key or not self._openai_v1:
+            return self.client
+        with self._client_lock:
+            if key not in self._openai_clients:
+                self._openai_clients[key] = self.client.with_options(api_key=key)
+            return self._openai_clients[key]
+
+    async def close(self):
+        """Close pooled provider connections"""
+        if self._openai_v1 and self.client is not None:
+            await self.client.close()
+            self.http_client = None
+            self.client = None
+            self._openai_clients.clear()
+
+    async def _call_openai(self, prompt: str, model_name: Optional[str] = None) -> str:
         """Call OpenAI API"""
+        pool = self.key_pools['openai']
+        slot = await pool.acquire(estimate_tokens(prompt))
         try:
-            if self.client is None:
-                if not self.openai_api_key:
-                    raise RuntimeError("OpenAI API key not configured")
-                # Try to (re)initialize client
-                try:
-                    from openai import OpenAI as _OpenAI
-                    self.client = _OpenAI(api_key=self.openai_api_key)
-                    self._openai_v1 = True
-                except Exception:
-                    openai.api_key = self.openai_api_key
-                    self.client = openai
-                    self._openai_v1 = False
+            client = self._openai_client_for(slot.key)
 
             if self._openai_v1:
-                response = await asyncio.to_thread(
-                    self.client.chat.completions.create,
-                    model="gpt-4o-mini",
+                response = await client.chat.completions.create(
+                    model=model_name or self.openai_model_name,
                     messages=[{"role": "user", "content": prompt}]
                 )
-                return response.choices[0].message.content
+                text = response.choices[0].message.content
             else:
                 # Legacy SDK (<1.0.0)
-                response = await asyncio.to_thread(
-                    self.client.ChatCompletion.create,
+                response = await client.ChatCompletion.acreate(
                     model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}]
+                    messages=[{"role": "user", "content": prompt}],
+                    api_key=slot.key
                 )
                 # Legacy shape: choices[0].message["content"]
-                return response.choices[0].message["content"]
+                text = response.choices[0].message["content"]
         except Exception as e:
-            raise Exception(f"OpenAI API error: {e}")
+            pool.release(slot, error=e)
+            raise Exception(f"OpenAI API error: {e}") from e
+        except BaseException:
+            pool.release(slot)  # cancelled: lost a hedge or ran out of time
+            raise
+        pool.release(slot, estimate_tokens(text or ''))
+        return text
     
-    async def _call_ai(self, prompt: str) -> str:
-        """Call the appropriate AI API"""
-        if self.use_gemini:
-            return await self._call_gemini(prompt)
-        else:
-            return await self._call_openai(prompt)
+    def _provider_model(self, provider: str, site: str = 'default') -> str:
+        """Model that answers a call site's requests on a provider"""
+        if provider == 'openai' and not (self._openai_v1 or self.client is None):
+            return 'gpt-3.5-turbo'
+        return self._model_for(site, provider)
+    
+    def _cache_lookup(self, prompt: str, site: str = 'default') -> Optional[str]:
+        """Cached response to a prompt from any configured provider, preferred first"""
+        if self.response_cache is None:
+            return None
+        # One logical lookup: probe each provider quietly, then count a single hit or miss
+        cached = None
+        for provider in self._configured_providers():
+            cached = self.response_cache.peek(
+                ResponseCache.make_key(prompt, provider, self._provider_model(provider, site)))
+            if cached is not None:
+                break
+        return self.response_cache.record(cached)
+    
+    def _cache_store(self, prompt: str, response: str, provider: str, site: str = 'default'):
+        """Store a successful response under the provider and model that produced it"""
+        if self.response_cache is None or not response:
+            return
+        model = self._provider_model(provider, site)
+        self.response_cache.put(ResponseCache.make_key(prompt, provider, model), response, provider, model)
+    
+    def _configured_providers(self) -> List[str]:
+        """Providers with an API key, preferred first"""
+        configured = [provider for provider, key in (('gemini', self.gemini_api_key), ('openai', self.openai_api_key)) if key]
+        if not self.use_gemini:
+            configured.reverse()
+        if self.adaptive_provider and all(self.latency[p].count >= self.latency[p].min_samples for p in configured):
+            configured.sort(key=lambda provider: self.latency[provider].ewma)
+        return configured
+    
+    def _provider_order(self) -> Iterable[str]:
+        """Configured providers, preferred first, skipping those whose breaker is open.
+
+        Lazy, so a breaker's half-open probe is only claimed when its provider
+        is actually called.
+        """
+        configured = self._configured_providers()
+        tried = False
+        for provider in configured:
+            if self.breakers[provider].allow():
+                tried = True
+                yield provider
+        if not tried:
+            # With every breaker open, trying the preferred provider beats failing outright
+            yield configured[0]
+    
+    @staticmethod
+    def _is_retryable(error: BaseException) -> bool:
+        """Whether an error is transient: timeouts, connection problems, rate limits, 5xx"""
+        while error is not None:
+            status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+            if isinstance(status, int) and (status == 429 or 500 <= status < 600):
+                return True
+            if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+                return True
+            name = type(error).__name__
+            if any(word in name for word in ('Timeout', 'Connection', 'RateLimit', 'ServiceUnavailable',
+                                              'ResourceExhausted', 'InternalServer', 'DeadlineExceeded')):
+                return True
+            error = error.__cause__
+        return False
+    
+    async def _with_retries(self, make_call: Callable[[], Awaitable[Any]]) -> Any:
+        """Await make_call(), retrying transient errors with full-jitter exponential back-off"""
+        for attempt in range(self.ai_retries + 1):
+            try:
+                return await make_call()
+            except Exception as e:
+                if attempt >= self.ai_retries or not self._is_retryable(e):
+                    raise
+                await asyncio.sleep(random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)))
+    
+    def _api_error(self, provider: str, message: str) -> Exception:
+        """Provider error in the shape the SDK wrappers raise"""
+        return Exception(f"{'Gemini' if provider == 'gemini' else 'OpenAI'} API error: {message}")
+    
+    async def _attempt(self, provider: str, prompt: str, deadline: float,
+                       model_name: Optional[str] = None) -> Tuple[str, str]:
+        """(provider, answer) within deadline, updating the provider's breaker and latency stats"""
+        call = self._call_gemini if provider == 'gemini' else self._call_openai
+        breaker = self.breakers[provider]
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self._with_retries(lambda: call(prompt, model_name)), deadline)
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            raise self._api_error(provider, f"no response within {deadline:g}s")
+        except asyncio.CancelledError:
+            # Lost a hedge: it took at least this long, which keeps a slowed-down provider's EWMA honest
+            self.latency[provider].record(time.perf_counter() - started)
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        self.latency[provider].record(time.perf_counter() - started)
+        return provider, response
+    
+    @staticmethod
+    async def _first_success(tasks: List[asyncio.Task]) -> Any:
+        """Result of the first task to succeed; the others are cancelled"""
+        pending = set(tasks)
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _call_ai(self, prompt: str, site: str = 'default') -> str:
+        """Call the appropriate AI API.
+
+        Each provider gets the call site's deadline, covering its retries;
+        on failure the next provider is tried and the failure is recorded in
+        the provider's circuit breaker. With hedging on, the next provider is
+        also started when the first hasn't answered within its p90 latency,
+        and whichever answers first wins.
+        """
+        cached = self._cache_lookup(prompt, site)
+        if cached is not None:
+            return cached
+        
+        deadline = self.call_deadlines.get(site, self.call_deadlines['default'])
+        started = time.perf_counter()
+        providers = self._provider_order()
+        error = None
+        for provider in providers:
+            tasks = [asyncio.ensure_future(self._attempt(provider, prompt, deadline, self._model_for(site, provider)))]
+            if self.hedging:
+                hedge_delay = self.latency[provider].percentile(90) or self.hedge_default_delay
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    backup = next(providers, None)
+                    if backup is not None:
+                        tasks.append(asyncio.ensure_future(
+                            self._attempt(backup, prompt, deadline, self._model_for(site, backup))))
+            try:
+                # A hedge may have been won by the backup provider
+                answered_by, response = await self._first_success(tasks)
+            except Exception as e:
+                error = e
+                continue
+            self.site_latency.get(site, self.site_latency['default']).record(time.perf_counter() - started)
+            self._cache_store(prompt, response, answered_by, site)
+            return response
+        raise error
+    
+    @staticmethod
+    def _gemini_chunk_text(chunk) -> Optional[str]:
+        """Text of a Gemini stream chunk (chunks without text parts raise in the SDK)"""
+        try:
+            return chunk.text
+        except Exception:
+            return None
+    
+    async def _stream_gemini(self, prompt: str, model_name: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream a Gemini completion chunk by chunk"""
+        pool = self.key_pools['gemini']
+        slot = await pool.acquire(estimate_tokens(prompt))
+        streamed = 0
+        try:
+            model = self._gemini_model_for(slot.key, model_name or self.gemini_model_name)
+            response = await model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                text = self._gemini_chunk_text(chunk)
+                if text:
+                    streamed += estimate_tokens(text)
+                    yield text
+        except Exception as e:
+            pool.release(slot, streamed, error=e)
+            raise Exception(f"Gemini API error: {e}") from e
+        except BaseException:
+            pool.release(slot, streamed)  # consumer stopped early
+            raise
+        pool.release(slot, streamed)
+    
+    async def _stream_openai(self, prompt: str, model_name: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream an OpenAI completion chunk by chunk"""
+        pool = self.key_pools['openai']
+        slot = await pool.acquire(estimate_tokens(prompt))
+        streamed = 0
+        try:
+            client = self._openai_client_for(slot.key)
+            
+            if self._openai_v1:
+                stream = await client.chat.completions.create(
+                    model=model_name or self.openai_model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    stream=True
+                )
+                async for chunk in stream:
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        streamed += estimate_tokens(text)
+                        yield text
+            else:
+                # Legacy SDK (<1.0.0)
+                stream = await client.ChatCompletion.acreate(
+                    model="gpt-3.5-turbo",
+                    messages=[{"role": "user", "content": prompt}],
+                    api_key=slot.key,
+                    stream=True
+                )
+                async for chunk in stream:
+                    text = chunk["choices"][0]["delta"].get("content")
+                    if text:
+                        streamed += estimate_tokens(text)
+                        yield text
+        except Exception as e:
+            pool.release(slot, streamed, error=e)
+            raise Exception(f"OpenAI API error: {e}") from e
+        except BaseException:
+            pool.release(slot, streamed)  # consumer stopped early
+            raise
+        pool.release(slot, streamed)
+    
+    async def _open_stream(self, provider: str, prompt: str, model_name: Optional[str] = None) -> Tuple[Optional[str], AsyncIterator[str]]:
+        """Start a provider stream and wait for its first chunk"""
+        stream = (self._stream_gemini if provider == 'gemini' else self._stream_openai)(prompt, model_name)
+        try:
+            return await stream.__anext__(), stream
+        except StopAsyncIteration:
+            return None, stream
+    
+    async def stream_ai(self, prompt: str, site: str = 'default') -> AsyncIterator[str]:
+        """Stream the response of the appropriate AI API as text chunks.
+
+        The call site's deadline bounds the wait for the first chunk and every
+        gap between chunks. Providers are only switched before anything was
+        yielded, otherwise output would be duplicated. A completed stream's
+        duration is recorded in the provider's latency stats.
+        """
+        if not self.streaming:
+            yield await self._call_ai(prompt, site)
+            return
+        
+        cached = self._cache_lookup(prompt, site)
+        if cached is not None:
+            yield cached
+            return
+        
+        deadline = self.call_deadlines.get(site, self.call_deadlines['default'])
+        started = time.perf_counter()
+        error = None
+        for provider in self._provider_order():
+            breaker = self.breakers[provider]
+            model_name = self._model_for(site, provider)
+            provider_started = time.perf_counter()
+            try:
+                first, stream = await asyncio.wait_for(
+                    self._with_retries(lambda: self._open_stream(provider, prompt, model_name)), deadline)
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                error = self._api_error(provider, f"no response within {deadline:g}s")
+                continue
+            except Exception as e:
+                breaker.record_failure()
+                error = e
+                continue
+            
+            chunks = []
+            try:
+                while first is not None:
+                    chunks.append(first)
+                    yield first
+                    try:
+                        first = await asyncio.wait_for(stream.__anext__(), deadline)
+                    except StopAsyncIteration:
+                        first = None
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                raise self._api_error(provider, f"stream stalled for {deadline:g}s")
+            except Exception:
+                breaker.record_failure()
+                raise
+            finally:
+                await stream.aclose()
+            breaker.record_success()
+            # Whole-stream time, comparable to a non-streamed call's, feeds provider ordering and hedging
+            finished = time.perf_counter()
+            self.latency[provider].record(finished - provider_started)
+            self.site_latency.get(site, self.site_latency['default']).record(finished - started)
+            self._cache_store(prompt, ''.join(chunks), provider, site)
+            return
+        raise error
     
     def _parse_ai_response(self, response: str) -> AIResponse:
         """Parse AI response and extract commands"""
@@ -339,7 +1961,7 @@ RECENT HISTORY (last {len(history)} commands):
         self.thinking_steps = []
         
         # Initial thinking prompt
-        context = self._build_context_prompt(current_dir, history)
+        context = self._build_context_prompt(current_dir, history, user_input)
         
         think_prompt = f"""{context}
 
@@ -371,16 +1993,15 @@ Common exploration patterns:
 Generate exploration commands now:"""
 
         try:
-            response = await self._call_ai(think_prompt)
+            response = await self._call_ai(think_prompt, site='thinking')
             ai_response = self._parse_ai_response(response)
             
             if ai_response.exploration_commands:
                 # Execute exploration commands
                 exploration_results = []
+                outcomes = await self._run_exploration_commands(ai_response.exploration_commands, current_dir)
                 
-                for cmd in ai_response.exploration_commands:
-                    returncode, stdout, stderr = await self._execute_thinking_command(cmd, current_dir)
-                    
+                for cmd, (returncode, stdout, stderr, duration) in zip(ai_response.exploration_commands, outcomes):
                     exploration_results.append({
                         'command': cmd,
                         'returncode': returncode,
@@ -393,7 +2014,8 @@ Generate exploration commands now:"""
                         command=cmd,
                         output=stdout if returncode == 0 else stderr,
                         reasoning=f"Exploring to understand user request: {user_input}",
-                        next_action="Continue exploration or provide final answer"
+                        next_action="Continue exploration or provide final answer",
+                        duration=duration
                     ))
                 
                 # Now analyze the results and provide final answer
@@ -410,7 +2032,7 @@ Generate exploration commands now:"""
 
     async def _analyze_exploration_results(self, user_input: str, current_dir: str, history: List[Dict], exploration_results: List[Dict]) -> AIResponse:
         """Analyze exploration results and provide final answer"""
-        context = self._build_context_prompt(current_dir, history)
+        context = self._build_context_prompt(current_dir, history, user_input)
         
         # Build exploration summary
         exploration_summary = "EXPLORATION RESULTS:\n"
@@ -419,6 +2041,9 @@ Generate exploration commands now:"""
             if result['returncode'] == 0:
                 exploration_summary += f"Output:\n{result['stdout']}\n"
             else:
+                # A stopped or failing probe may still have produced useful output
+                if result['stdout'].strip():
+                    exploration_summary += f"Output:\n{result['stdout']}\n"
                 exploration_summary += f"Error: {result['stderr']}\n"
             exploration_summary += "-" * 40 + "\n"
         
@@ -453,7 +2078,7 @@ Examples:
 Provide your final analysis now:"""
 
         try:
-            response = await self._call_ai(analysis_prompt)
+            response = await self._call_ai(analysis_prompt, site='analysis')
             return self._parse_ai_response(response)
         except Exception as e:
             return AIResponse(
@@ -462,17 +2087,11 @@ Provide your final analysis now:"""
                 needs_clarification=False
             )
 
-    async def process_natural_language(self, user_input: str, current_dir: str, history: List[Dict]) -> AIResponse:
-        """Process natural language input and generate shell commands"""
-        
-        # Check if this requires thinking mode
-        if self._requires_thinking(user_input):
-            return await self._think_and_explore(user_input, current_dir, history)
-        
-        # Regular processing for direct commands
-        context = self._build_context_prompt(current_dir, history)
+    def _build_command_prompt(self, user_input: str, current_dir: str, history: List[Dict]) -> str:
+        """Build the prompt that converts a natural language request into commands"""
+        context = self._build_context_prompt(current_dir, history, user_input)
         
-        prompt = f"""{context}
+        return f"""{context}
 
         TASK: Convert the following natural language request into shell commands.
 
@@ -505,8 +2124,23 @@ Provide your final analysis now:"""
 
         Generate commands now:"""
 
+    async def process_natural_language(self, user_input: str, current_dir: str, history: List[Dict]) -> AIResponse:
+        """Process natural language input and generate shell commands"""
+        
+        # Common requests are answered locally without an AI call
+        local_response = self._match_intent(user_input)
+        if local_response:
+            return local_response
+        
+        # Check if this requires thinking mode
+        if self._requires_thinking(user_input):
+            return await self._think_and_explore(user_input, current_dir, history)
+        
+        # Regular processing for direct commands
+        prompt = self._build_command_prompt(user_input, current_dir, history)
+
         try:
-            response = await self._call_ai(prompt)
+            response = await self._call_ai(prompt, site='command')
             return self._parse_ai_response(response)
         except Exception as e:
             return AIResponse(
@@ -515,9 +2149,41 @@ Provide your final analysis now:"""
                 needs_clarification=False
             )
     
+    async def stream_natural_language(self, user_input: str, current_dir: str, history: List[Dict]) -> AsyncIterator[Tuple[str, Any]]:
+        """Stream natural language processing as (event, value) pairs.
+
+        Yields ('message', text_so_far) while the explanation is generated,
+        ('commands', command) for every command as soon as it is complete and
+        finally ('done', AIResponse) with the fully parsed response.
+        """
+        local_response = self._match_intent(user_input)
+        if local_response:
+            yield 'done', local_response
+            return
+        
+        # Thinking mode runs several round trips and local commands, nothing to stream
+        if self._requires_thinking(user_input):
+            yield 'done', await self._think_and_explore(user_input, current_dir, history)
+            return
+        
+        prompt = self._build_command_prompt(user_input, current_dir, history)
+        extractor = StreamingJSONExtractor()
+        
+        try:
+            async for chunk in self.stream_ai(prompt, site='command'):
+                for event in extractor.feed(chunk):
+                    yield event
+            yield 'done', self._parse_ai_response(extractor.text)
+        except Exception as e:
+            yield 'done', AIResponse(
+                message=f"AI error: {str(e)}",
+                suggested_commands=[],
+                needs_clarification=False
+            )
+    
     async def process_with_clarification(self, original_input: str, clarification: str, current_dir: str, history: List[Dict]) -> AIResponse:
         """Process natural language with additional clarification"""
-        context = self._build_context_prompt(current_dir, history)
+        context = self._build_context_prompt(current_dir, history, f"{original_input} {clarification}")
         
         prompt = f"""{context}
 
@@ -540,7 +2206,7 @@ Now generate the appropriate commands in JSON format:
 Generate commands now:"""
 
         try:
-            response = await self._call_ai(prompt)
+            response = await self._call_ai(prompt, site='command')
             return self._parse_ai_response(response)
         except Exception as e:
             return AIResponse(
@@ -551,7 +2217,7 @@ Generate commands now:"""
     
     async def analyze_error(self, failed_command: str, returncode: int, stdout: str, stderr: str, history: List[Dict]) -> AIResponse:
         """Analyze command error and suggest fixes"""
-        context = self._build_context_prompt(os.getcwd(), history)
+        context = self._build_context_prompt(os.getcwd(), history, failed_command)
         
         prompt = f"""{context}
 
@@ -586,7 +2252,7 @@ Common error patterns:
 Analyze the error and provide a fix:"""
 
         try:
-            response = await self._call_ai(prompt)
+            response = await self._call_ai(prompt, site='error')
             return self._parse_ai_response(response)
         except Exception as e:
             return AIResponse(
@@ -597,7 +2263,7 @@ Analyze the error and provide a fix:"""
     
     async def analyze_error_with_clarification(self, failed_command: str, returncode: int, stdout: str, stderr: str, history: List[Dict], clarification: str) -> AIResponse:
         """Analyze error with user clarification"""
-        context = self._build_context_prompt(os.getcwd(), history)
+        context = self._build_context_prompt(os.getcwd(), history, f"{failed_command} {clarification}")
         
         prompt = f"""{context}
 
@@ -623,7 +2289,7 @@ Now provide a fix in JSON format:
 Generate fix now:"""
 
         try:
-            response = await self._call_ai(prompt)
+            response = await self._call_ai(prompt, site='error')
             return self._parse_ai_response(response)
         except Exception as e:
             return AIResponse(
@@ -632,11 +2298,11 @@ Generate fix now:"""
                 needs_clarification=False
             )
     
-    async def answer_question(self, question: str, history: List[Dict]) -> str:
-        """Answer general questions (not command generation)"""
-        context = self._build_context_prompt(os.getcwd(), history)
+    def _build_question_prompt(self, question: str, history: List[Dict]) -> str:
+        """Build the prompt for answering a general question"""
+        context = self._build_context_prompt(os.getcwd(), history, question)
         
-        prompt = f"""{context}
+        return f"""{context}
 
 TASK: Answer the user's general question (not a command generation request).
 
@@ -650,13 +2316,27 @@ INSTRUCTIONS:
 5. Use markdown formatting for better readability
 
 Answer the question now:"""
+    
+    async def answer_question(self, question: str, history: List[Dict]) -> str:
+        """Answer general questions (not command generation)"""
+        prompt = self._build_question_prompt(question, history)
 
         try:
-            response = await self._call_ai(prompt)
+            response = await self._call_ai(prompt, site='question')
             return response
         except Exception as e:
             return f"AI error: {str(e)}"
     
+    async def stream_answer_question(self, question: str, history: List[Dict]) -> AsyncIterator[str]:
+        """Answer general questions, yielding the markdown answer as it is generated"""
+        prompt = self._build_question_prompt(question, history)
+
+        try:
+            async for chunk in self.stream_ai(prompt, site='question'):
+                yield chunk
+        except Exception as e:
+            yield f"\n\nAI error: {str(e)}"
+    
     def add_to_temp_memory(self, interaction: Dict[str, Any]):
         """Add interaction to temporary memory"""
         self.temp_memory.append(interaction)
@@ -671,7 +2351,16 @@ Answer the question now:"""
             'temp_memory_count': len(self.temp_memory),
             'system_info': self.system_info,
             'using_gemini': self.use_gemini,
-            'thinking_steps_count': len(self.thinking_steps)
+            'thinking_steps_count': len(self.thinking_steps),
+            'response_cache': self.response_cache.stats() if self.response_cache else None,
+            'last_context': self.last_context_report,
+            'provider_breakers': {provider: breaker.state for provider, breaker in self.breakers.items()},
+            'provider_latency': {provider: tracker.stats() for provider, tracker in self.latency.items()},
+            'api_keys': {provider: pool.stats() for provider, pool in self.key_pools.items() if pool.slots},
+            'call_sites': {
+                site: dict(self.site_latency[site].stats(), models=route)
+                for site, route in self.model_routes.items()
+            }
         }
     
     def get_thinking_steps(self) -> List[ThinkingStep]:
@@ -1,9 +1,8 @@
 import re  # Add this import
 import os
 import sys
+import time
 import subprocess
-import shutil
-import platform
 import signal
 import pty
 import select
@@ -13,19 +12,15 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional, Tuple
 import asyncio
 import readline
-import json
 from datetime import datetime
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
 from rich.prompt import Prompt, Confirm
-from rich.syntax import Syntax
-from rich.live import Live
-from rich.spinner import Spinner
 from rich import box
 from rich.markdown import Markdown
+from rich.markup import escape
 from rich.theme import Theme
-from rich.progress import Progress, SpinnerColumn, TextColumn
 from dotenv import load_dotenv
 
 from ai_agent import AIAgent
@@ -125,9 +120,68 @@ class NLShell:
             self.console.print(response_panel)
         
         return True
+    async def _handle_batch_analysis(self, user_input: str) -> bool:
+        """Handle directory and glob analysis requests"""
+        
+        batch_patterns = [
+            r"^analyze (?:the )?(?:directory|dir|folder) (.+)",
+            r"^analyze (?:all )?files in (.+)",
+            r"^analyze files (.+)",
+        ]
+        
+        target = None
+        for pattern in batch_patterns:
+            match = re.search(pattern, user_input.strip(), re.IGNORECASE)
+            if match:
+                target = match.group(1).strip().strip('"\'')
+                break
+        
+        if not target:
+            return False
+        
+        paths = self.ai_agent.expand_analysis_target(target, self.current_dir)
+        if not paths:
+            self.console.print(f"[red]No files match: {target}[/red]")
+            return True
+        
+        self.console.print(f"[yellow]🤖 Analyzing {len(paths)} files in {target}[/yellow]")
+        
+        results = []
+        async for result in self.ai_agent.analyze_batch(paths):
+            results.append(result)
+            content = result.get('content') or {}
+            error = result.get('error') or content.get('error')
+            name = os.path.relpath(result.get('filepath', '?'), self.current_dir)
+            if error:
+                self.console.print(f"  [red]✗[/red] {escape(name)} [dim]{escape(error)}[/dim]")
+            else:
+                cached = " [dim](cached)[/dim]" if result.get('cached') else ""
+                self.console.print(f"  [green]✓[/green] {escape(name)} [dim]{content.get('type', 'file')}, {result.get('size', 0):,} bytes[/dim]{cached}")
+        
+        summary = self.ai_agent.summarize_batch(results)
+        summary_info = [
+            f"**Files:** {summary['files']} ({summary['cached']} cached, {summary['errors']} errors)",
+            f"**Total Size:** {summary['total_size']:,} bytes",
+            "**By Type:** " + ", ".join(f"{kind} ({count})" for kind, count in summary['by_type'].items()),
+            "\n**Largest Files:**",
+        ]
+        for entry in summary['largest']:
+            summary_info.append(f"- `{os.path.relpath(entry['filepath'], self.current_dir)}` ({entry['size']:,} bytes)")
+        
+        self.console.print(Panel(
+            Markdown("\n".join(summary_info)),
+            title="[bold green]Batch Analysis[/bold green]",
+            border_style="green",
+            box=box.ROUNDED
+        ))
+        return True
+    
     async def _handle_file_analysis(self, user_input: str) -> bool:
         """Handle file analysis requests"""
         
+        if await self._handle_batch_analysis(user_input):
+            return True
+        
         # Pattern matching for file analysis
         file_patterns = [
             r"what'?s in (this|the) file (.+)",
@@ -137,6 +191,14 @@ class NLShell:
             r"open (.+\.\w+)",
         ]
         
+        # Optional trailing page range for PDFs: "... pages 10-20" or "... page 7"
+        page_range = None
+        range_match = re.search(r"\s+pages?\s+(\d+)(?:\s*(?:-|to)\s*(\d+))?\s*$", user_input, re.IGNORECASE)
+        if range_match:
+            first = int(range_match.group(1))
+            page_range = (first, int(range_match.group(2) or first))
+            user_input = user_input[:range_match.start()]
+        
         filepath = None
         for pattern in file_patterns:
             match = re.search(pattern, user_input.lower())
@@ -155,7 +217,7 @@ class NLShell:
         self.console.print(f"[yellow]🤖 Analyzing file: {filepath}[/yellow]")
         
         with self.console.status("[blue]Reading file...[/blue]", spinner="dots"):
-            file_result = await self.ai_agent.analyze_file(filepath)
+            file_result = await self.ai_agent.analyze_file(filepath, page_range)
         
         if file_result.get('error'):
             self.console.print(f"[red]Error: {file_result['error']}[/red]")
@@ -166,6 +228,8 @@ class NLShell:
         content_info.append(f"**File:** `{file_result['filepath']}`")
         content_info.append(f"**Size:** {file_result['size']:,} bytes")
         content_info.append(f"**Type:** {file_result.get('mime_type', 'Unknown')}")
+        if file_result.get('cached'):
+            content_info.append("**Analysis:** cached (file unchanged)")
         
         if 'content' in file_result:
             content = file_result['content']
@@ -173,10 +237,18 @@ class NLShell:
             if content.get('type') == 'text':
                 content_info.append(f"**Lines:** {content['lines']}")
                 content_info.append(f"**Characters:** {content['characters']}")
+                if content.get('encoding'):
+                    content_info.append(f"**Encoding:** {content['encoding']}")
                 content_info.append(f"\n**Preview:**\n```\n{content['preview']}\n```")
             
             elif content.get('type') == 'json':
                 content_info.append(f"**Structure:** {content['structure']}")
+                if content.get('records') is not None:
+                    content_info.append(f"**Records:** {content['records']:,} ({content['record_type']})")
+                elif content.get('length') is not None:
+                    content_info.append(f"**Length:** {content['length']:,}")
+                if content.get('depth'):
+                    content_info.append(f"**Depth:** {content['depth']}")
                 if content.get('keys'):
                     content_info.append(f"**Keys:** {', '.join(content['keys'][:10])}")
                 content_info.append(f"\n**Preview:**\n```json\n{content['preview']}\n```")
@@ -186,10 +258,28 @@ class NLShell:
                 content_info.append(f"**Columns:** {content['columns']}")
                 if content.get('column_names'):
                     content_info.append(f"**Column Names:** {', '.join(content['column_names'])}")
+                if content.get('column_stats'):
+                    stats_lines = []
+                    for name, stats in content['column_stats'].items():
+                        line = f"{name}: {stats['nulls']} nulls, ~{stats['distinct']} distinct"
+                        if stats.get('min') is not None:
+                            line += f", range {stats['min']} to {stats['max']}"
+                        stats_lines.append(line)
+                    content_info.append("\n**Column Stats:**\n```\n" + "\n".join(stats_lines) + "\n```")
                 content_info.append(f"\n**Preview:**\n```\n{content['preview']}\n```")
             
+            elif content.get('type') == 'excel':
+                content_info.append(f"**Sheets:** {content['sheet_count']}")
+                for sheet in content.get('sheets', []):
+                    content_info.append(f"\n**{sheet['name']}** ({sheet['rows']:,} rows x {sheet['columns']} columns)")
+                    if sheet['preview']:
+                        content_info.append(f"```\n{sheet['preview']}\n```")
+            
             elif content.get('type') == 'pdf':
                 content_info.append(f"**Pages:** {content['pages']}")
+                if content.get('page_range'):
+                    first, last = content['page_range']
+                    content_info.append(f"**Extracted:** pages {first}-{last} ({content['cached_pages']} from cache)")
                 if content.get('text_preview'):
                     content_info.append(f"\n**Text Preview:**\n```\n{content['text_preview']}\n```")
             
@@ -227,6 +317,7 @@ class NLShell:
     
     def _signal_handler(self, signum, frame):
         """Handle Ctrl+C gracefully"""
+        self.ai_core.interrupt_commands()
         self.console.print("\n[yellow]Interrupted. Type 'exit' to quit.[/yellow]")
     
     def _get_shell_prompt(self) -> str:
@@ -316,7 +407,7 @@ class NLShell:
         
         thinking_text = "## AI Thinking Process\n\n"
         for i, step in enumerate(thinking_steps, 1):
-            thinking_text += f"**Step {i}:** `{step.command}`\n"
+            thinking_text += f"**Step {i}:** `{step.command}` ({step.duration:.2f}s)\n"
             thinking_text += f"*Reasoning:* {step.reasoning}\n"
             thinking_text += f"*Output:* {step.output[:200]}{'...' if len(step.output) > 200 else ''}\n"
             thinking_text += f"*Next Action:* {step.next_action}\n\n"
@@ -341,8 +432,12 @@ class NLShell:
         )
         self.console.print(thinking_panel)
     
-    async def _execute_command(self, command: str) -> Tuple[int, str, str]:
-        """Execute a shell command and return (returncode, stdout, stderr)"""
+    async def _execute_command(self, command: str, detach: bool = False) -> Tuple[int, str, str]:
+        """Execute a shell command and return (returncode, stdout, stderr).
+
+        Unless detach is set the command's output goes straight to the terminal
+        and the returned output is a capped copy (see _output_shown_live).
+        """
         try:
             # Handle cd command specially
             if command.strip().startswith('cd '):
@@ -361,19 +456,15 @@ class NLShell:
                 return await self._execute_interactive_command(command)
             
             # Execute other commands normally
-            process = await asyncio.create_subprocess_shell(
-                command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=self.current_dir
-            )
-            
-            stdout, stderr = await process.communicate()
-            return process.returncode, stdout.decode('utf-8'), stderr.decode('utf-8')
+            return await self.ai_core.run_command(command, self.current_dir, detach=detach)
             
         except Exception as e:
             return 1, "", str(e)
     
+    def _output_shown_live(self, command: str) -> bool:
+        """Whether _execute_command already showed the command's output (everything but cd)"""
+        return not command.strip().startswith('cd ')
+    
     async def _execute_interactive_command(self, command: str) -> Tuple[int, str, str]:
         """Execute an interactive command using pty for real-time I/O"""
         try:
@@ -489,6 +580,72 @@ class NLShell:
             self.console.print(f"[bold red]Error running interactive command: {e}[/bold red]")
             return 1, "", str(e)
     
+    def _answer_panel(self, answer) -> Panel:
+        """Panel for an AI answer (markdown text or a placeholder renderable)"""
+        return Panel(
+            Markdown(answer) if isinstance(answer, str) else answer,
+            title="[bold magenta]AI Response[/bold magenta]",
+            border_style="magenta",
+            box=box.ROUNDED
+        )
+    
+    async def _stream_question_answer(self, question: str) -> str:
+        """Render the answer to a question progressively as it streams in"""
+        from rich.live import Live
+        from rich.spinner import Spinner
+        
+        answer = ""
+        placeholder = Spinner("dots", text="[blue]Processing question...[/blue]")
+        
+        with Live(self._answer_panel(placeholder), console=self.console, refresh_per_second=12) as live:
+            async for chunk in self.ai_core.stream_answer_question(question, self.history):
+                answer += chunk
+                live.update(self._answer_panel(answer))
+        
+        return answer
+    
+    def _streaming_command_panel(self, message: str, commands: List[str]) -> Panel:
+        """Panel showing a command response while it is still being generated"""
+        from rich.spinner import Spinner
+        
+        parts = []
+        if message:
+            parts.append(f"[dim]{escape(message)}[/dim]")
+        if commands:
+            parts.append("\n".join([f"[bold green]${escape(command)}[/bold green]" for command in commands]))
+        
+        return Panel(
+            "\n\n".join(parts) if parts else Spinner("dots", text="[blue]Analyzing request...[/blue]"),
+            title="[bold cyan]AI is generating...[/bold cyan]",
+            border_style="blue",
+            box=box.ROUNDED
+        )
+    
+    async def _stream_natural_language(self, user_input: str):
+        """Show the message and commands as they stream in, return the final AIResponse"""
+        from rich.live import Live
+        
+        message = ""
+        commands = []
+        ai_response = None
+        
+        # Transient: the regular panels replace the preview once the response is complete
+        with Live(self._streaming_command_panel(message, commands), console=self.console,
+                  refresh_per_second=12, transient=True) as live:
+            async for event, value in self.ai_core.stream_natural_language(user_input, self.current_dir, self.history):
+                if event == 'done':
+                    ai_response = value
+                    break
+                if event == 'message':
+                    message = value
+                elif event == 'commands':
+                    commands.append(value)
+                else:
+                    continue
+                live.update(self._streaming_command_panel(message, commands))
+        
+        return ai_response
+    
     def _display_commands(self, commands: List[str], title: str = "AI Generated Commands"):
         """Display commands in a nice panel"""
         command_text = "\n".join([f"[bold green]${command}[/bold green]" for command in commands])
@@ -520,21 +677,18 @@ class NLShell:
             if not auto_confirm:
                 self.console.print(f"\n[dim]Executing {i}/{len(commands)}:[/dim] [bold]{command}[/bold]")
             
-            # Check if it's an interactive command - don't show spinner for those
-            if self._is_interactive_command(command):
-                returncode, stdout, stderr = await self._execute_command(command)
+            if auto_confirm and not self._is_interactive_command(command):
+                # For thinking mode, show minimal output: run like an exploration probe
+                returncode, stdout, stderr = await self._execute_command(command, detach=True)
             else:
-                if auto_confirm:
-                    # For thinking mode, show minimal output
-                    returncode, stdout, stderr = await self._execute_command(command)
-                else:
-                    with self.console.status(f"[blue]Running command {i}...[/blue]", spinner="dots"):
-                        returncode, stdout, stderr = await self._execute_command(command)
+                # Output and any prompts go straight to the terminal
+                returncode, stdout, stderr = await self._execute_command(command)
+            live = self._output_shown_live(command)
             
             if returncode == 0:
                 success_count += 1
-                if stdout.strip() and not self._is_interactive_command(command) and not auto_confirm:
-                    # Display output in a subtle panel (only for non-interactive commands)
+                if stdout.strip() and not live and not auto_confirm:
+                    # Output the command did not show itself (cd), in a subtle panel
                     output_panel = Panel(
                         stdout.strip(),
                         title="[dim]Output[/dim]",
@@ -547,7 +701,7 @@ class NLShell:
             else:
                 if not auto_confirm:
                     self.console.print(f"[bold red]✗ Command failed (exit code {returncode})[/bold red]")
-                    if stderr.strip():
+                    if stderr.strip() and not live:
                         error_panel = Panel(
                             stderr.strip(),
                             title="[bold red]Error[/bold red]",
@@ -683,13 +837,13 @@ class NLShell:
                     returncode, stdout, stderr = await self._execute_command(command)
                     
                     if returncode == 0:
-                        if stdout.strip() and not self._is_interactive_command(command):
+                        if stdout.strip() and not self._output_shown_live(command):
                             self.console.print(stdout)
-                        elif not self._is_interactive_command(command):
+                        elif not stdout.strip() and not self._is_interactive_command(command):
                             self.console.print("[dim green]✓ Command completed[/dim green]")
                     else:
                         self.console.print(f"[bold red]Command failed (exit code {returncode})[/bold red]")
-                        if stderr.strip():
+                        if stderr.strip() and not self._output_shown_live(command):
                             self.console.print(f"[red]{stderr}[/red]")
                 
                 elif self._is_question(user_input):
@@ -705,16 +859,13 @@ class NLShell:
                     question = self._clean_question(user_input)
                     self.console.print("[yellow]🤖 AI is thinking...[/yellow]")
                     
-                    with self.console.status("[blue]Processing question...[/blue]", spinner="dots"):
-                        response = await self.ai_core.answer_question(question, self.history)
-                    
-                    answer_panel = Panel(
-                        Markdown(response),
-                        title="[bold magenta]AI Response[/bold magenta]",
-                        border_style="magenta",
-                        box=box.ROUNDED
-                    )
-                    self.console.print(answer_panel)
+                    if self.ai_core.streaming:
+                        await self._stream_question_answer(question)
+                    else:
+                        with self.console.status("[blue]Processing question...[/blue]", spinner="dots"):
+                            response = await self.ai_core.answer_question(question, self.history)
+                        
+                        self.console.print(self._answer_panel(response))
                                 
                 else:
                     # Natural language command (with potential thinking mode)
@@ -722,8 +873,11 @@ class NLShell:
                         continue
                     self.console.print("[yellow]🤖 AI is interpreting your command...[/yellow]")
                     
-                    with self.console.status("[blue]Analyzing request...[/blue]", spinner="dots"):
-                        ai_response = await self.ai_core.process_natural_language(user_input, self.current_dir, self.history)
+                    if self.ai_core.streaming:
+                        ai_response = await self._stream_natural_language(user_input)
+                    else:
+                        with self.console.status("[blue]Analyzing request...[/blue]", spinner="dots"):
+                            ai_response = await self.ai_core.process_natural_language(user_input, self.current_dir, self.history)
                     
                     # Check if AI is in thinking mode
                     if ai_response.thinking_mode and ai_response.exploration_commands:
@@ -815,9 +969,80 @@ class NLShell:
             except Exception as e:
                 self.console.print(f"[bold red]Unexpected error: {e}[/bold red]")
                 continue
+        
+        await self.ai_core.close()
+
+def profile_startup(top: int = 20):
+    """Report where a cold start spends its import time (python -X importtime)"""
+    from rich.table import Table
+    
+    console = Console()
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    code = (
+        "import time; started = time.perf_counter(); import nlshell; "
+        "imported = time.perf_counter(); nlshell.NLShell(); "
+        "print(f'{imported - started:.6f} {time.perf_counter() - imported:.6f}')"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [script_dir, os.environ.get('PYTHONPATH')])))
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, env=env)
+    wall_time = time.perf_counter() - started
+    
+    # Lines look like "import time:  self [us] | cumulative | <indent>package". A module is
+    # listed after its own imports, indented one space at top level and two more per level.
+    imports = []
+    total_us = 0
+    children = []
+    seen_nlshell = False
+    errors = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            errors.append(line)
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entry = (name.strip(), int(fields[0]), int(fields[1]))
+        if depth == 1:
+            children.append(entry)
+        elif depth == 0:
+            total_us += entry[2]
+            if entry[0] == 'nlshell':
+                # Break nlshell down into its direct imports
+                imports.extend(children)
+                imports.append(('nlshell (self)', entry[1], entry[1]))
+                seen_nlshell = True
+            elif seen_nlshell:
+                # Imported while constructing the shell
+                imports.append(entry)
+            children = []
+    
+    table = Table(title="Startup import times (modules imported by nlshell)", box=box.SIMPLE)
+    table.add_column("Module", style="cyan")
+    table.add_column("Self (ms)", justify="right")
+    table.add_column("Cumulative (ms)", justify="right", style="bold")
+    for name, self_us, cumulative_us in sorted(imports, key=lambda item: item[2], reverse=True)[:top]:
+        table.add_row(name, f"{self_us / 1000:.1f}", f"{cumulative_us / 1000:.1f}")
+    console.print(table)
+    
+    console.print(f"[bold]Total import time:[/bold] {total_us / 1000:.1f} ms")
+    timings = result.stdout.split()
+    if result.returncode == 0 and len(timings) == 2:
+        console.print(f"[bold]import nlshell:[/bold] {float(timings[0]) * 1000:.1f} ms")
+        console.print(f"[bold]NLShell():[/bold] {float(timings[1]) * 1000:.1f} ms")
+    else:
+        console.print("[yellow]Shell construction failed, timings cover imports only:[/yellow]")
+        console.print("\n".join(errors[-5:]), markup=False)
+    console.print(f"[bold]Process wall time:[/bold] {wall_time * 1000:.1f} ms")
 
 def main():
     """Entry point"""
+    if '--profile-startup' in sys.argv[1:]:
+        profile_startup()
+        return
+    
     try:
         shell = NLShell()
         asyncio.run(shell.run())